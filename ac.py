@@ -0,0 +1,167 @@
+"""
+Small-signal (AC) analysis: the steady-state response of a circuit to a
+sinusoidal source, at many frequencies at once.
+
+The complex nodal analysis matrix is the one of state.CircuitState.matrix with
+one more entry on the diagonal of every capacitor and inductor row: the
+impedance 1/(jwC) of a capacitor (with the sign of a source row) and jwL of an
+inductor. Everything else is the same at every frequency, so the matrix is
+assembled once and only those diagonal entries are filled in per frequency:
+dense systems are solved in stacks of frequencies with one batched solve, and
+sparse ones share a single CSC structure and column ordering.
+
+The DC batteries are shorted except for the one driving the circuit, which is
+a source of amplitude 1 V and phase 0, so the results are transfer functions.
+"""
+import numpy as np
+from solvers import pick_backend, load_scipy, to_dense
+from state import BATTERY
+
+# dense systems are solved in stacks of at most this many matrix entries
+# (frequencies * unknowns^2)
+BATCH_ENTRIES = 2**22
+
+
+def reactances(st):
+    """
+    The components whose entries depend on the frequency. Their diagonal entry
+    at angular frequency w is j(w L + S / w)
+    params:
+        st: class CircuitState object
+    return:
+        comps: array of the indices of the components
+        L, S: arrays. the coefficients of w and 1/w
+    """
+    caps, inds = st.capacitors, st.inductors
+    comps = np.concatenate([caps, inds])
+    L = np.concatenate([np.zeros(len(caps)), st.L[inds]])
+    S = np.concatenate([1. / st.cpty[caps], np.zeros(len(inds))])
+    return comps, L, S
+
+
+def frequency_response(st, freqs, source=None, backend="auto"):
+    """
+    Solves the complex nodal analysis at every frequency
+    params:
+        st: class CircuitState object
+        freqs: array-like. frequencies in Hz. must be positive
+        source: optional. index of the battery driving the circuit. defaults
+            to the first battery
+        backend: optional. see solvers.py
+    return:
+        v, i: complex arrays of shape (len(freqs), size). voltage and current
+            of every component at every frequency. Junction voltages are node
+            voltages; their currents are 0 (Kirchhoff's current law)
+    """
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+    if np.any(freqs <= 0):
+        raise ValueError("Frequencies must be positive")
+    if source is None:
+        batteries = np.flatnonzero(st.kind == BATTERY)
+        if len(batteries) == 0:
+            raise ValueError("AC analysis needs a battery as the source")
+        source = batteries[0]
+    elif st.kind[source] != BATTERY:
+        raise ValueError("The source must be a battery", source)
+
+    m = st.size - 1
+    u = st.unknown
+    # with a companion of zeros the inductor rows are voltage drops, to which
+    # the impedances are added
+    rows, cols, vals = st.matrix(companion=np.zeros(st.size))
+    comps, L, S = reactances(st)
+    omega = 2 * np.pi * freqs
+    diag = 1j * (np.outer(omega, L) + np.outer(1. / omega, S))
+
+    b = np.zeros(m, dtype=complex)
+    b[u[source]] = 1.
+
+    if pick_backend(backend, m) == "dense":
+        A = to_dense(rows, cols, vals, m).astype(complex)
+        x = np.zeros((len(freqs), m), dtype=complex)
+        step = max(BATCH_ENTRIES // max(m * m, 1), 1)
+        for start in range(0, len(freqs), step):
+            stack = np.repeat(A[None], len(diag[start:start+step]), axis=0)
+            stack[:, u[comps], u[comps]] += diag[start:start+step]
+            rhs = np.broadcast_to(b[:, None], (len(stack), m, 1))
+            x[start:start+step] = np.linalg.solve(stack, rhs)[..., 0]
+    else:
+        x = solve_sparse(rows, cols, vals, u[comps], diag, b, m)
+
+    n = len(freqs)
+    v = np.zeros((n, st.size), dtype=complex)
+    i = np.zeros((n, st.size), dtype=complex)
+    j = st.junctions[st.junctions != st.ground]
+    v[:, j] = x[:, u[j]]
+    c = st.branches
+    i[:, c] = x[:, u[c]]
+    # the voltage across a component is the difference of its terminals
+    v[:, c] = v[:, st.cxn[c, 1]] - v[:, st.cxn[c, 0]]
+    return v, i
+
+
+def solve_sparse(rows, cols, vals, d, diag, b, m):
+    """
+    Solves the systems of every frequency with one CSC structure: only the
+    values of the diagonal entries d change between frequencies. The
+    structure never changes either, so the fill-reducing column ordering of
+    SuperLU is computed once, at the first frequency; the columns are permuted
+    by it and the other frequencies are factored in that (natural) order
+    params:
+        rows, cols, vals: the constant part of the matrix
+        d: array. rows (and columns) of the frequency dependent entries
+        diag: complex array of shape (F, len(d)). their values
+        b: complex array of shape (m,). the right-hand side
+        m: int. number of unknowns
+    return:
+        complex array of shape (F, m)
+    """
+    scipy = load_scipy()
+    splu = scipy.sparse.linalg.splu
+    rows = np.concatenate([rows, d])
+    cols = np.concatenate([cols, d])
+    vals = np.concatenate([vals, np.zeros(len(d))])
+    # where the diagonal entries end up in A.data: mark them with their
+    # position + 1 in a matrix of the same structure
+    mark = np.concatenate([np.zeros(len(vals) - len(d)), \
+                           np.arange(1, len(d) + 1)])
+
+    def assemble(cols):
+        A = scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(m, m))
+        A = A.tocsc().astype(complex)
+        M = scipy.sparse.coo_matrix((mark, (rows, cols)), shape=(m, m)).tocsc()
+        pos = np.flatnonzero(M.data)
+        return A, pos, M.data[pos].astype(int) - 1
+
+    x = np.zeros((len(diag), m), dtype=complex)
+    if len(diag) == 0:
+        return x
+    A, pos, order = assemble(cols)
+    A.data[pos] += diag[0, order]
+    lu = splu(A)
+    x[0] = lu.solve(b)
+    # column j of the permuted matrix is column perm[j] of A, so the solution
+    # of the permuted system y is x[perm]
+    perm = lu.perm_c
+    inv = np.empty(m, dtype=int)
+    inv[perm] = np.arange(m)
+    A, pos, order = assemble(inv[cols])
+    base = A.data[pos].copy()
+    for k in range(1, len(diag)):
+        A.data[pos] = base + diag[k, order]
+        x[k, perm] = splu(A, permc_spec="NATURAL").solve(b)
+    return x
+
+
+def bode(h):
+    """
+    Magnitude and phase of a frequency response
+    params:
+        h: complex array. e.g. a column of the voltages of frequency_response
+    return:
+        gain: array. 20 log10 |h| in dB
+        phase: array. in degrees, unwrapped along the last axis
+    """
+    h = np.asarray(h)
+    gain = 20. * np.log10(np.maximum(np.abs(h), 1e-300))
+    return gain, np.degrees(np.unwrap(np.angle(h), axis=-1))
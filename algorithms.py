@@ -1,103 +1,112 @@
-import numpy as np
-
-# total resistance in a circuit. could be one of backtracker's params
-total_res = 0
-
-
-def is_repeating(hist):
+def adjacency_list(num_vertices, edges):
     """
-    Checks if list is repeating. A list is repeating if the same two elements
-    occur repeatedly at the end.
+    Builds the adjacency list of a (multi)graph
+    params:
+        num_vertices: int. number of vertices
+        edges: list of (start, end) pairs
+    returns:
+        list. for every vertex, a list of (neighbour, edge index) pairs
     """
-    l = len(hist)
-    if l < 4:
-        return False
-    else:
-        return hist[l-1] == hist[l-3] and hist[l-2] == hist[l-4]
-
+    adj = [[] for _ in range(num_vertices)]
+    for e in range(len(edges)):
+        start, end = edges[e]
+        adj[start].append((end, e))
+        adj[end].append((start, e))
+    return adj
 
-def subsetof(a, b):
-    """Checks if list a is a subset of list b"""
-    matches = 0
-    for i in a:
-        for j in b:
-            if np.array_equal(i, j) or np.array_equal(i, j[::-1]):
-                matches += 1
-    return len(a) == matches
 
-
-def backtracker(Graph, target, current_node, visited_nodes, available_edges):
+def biconnected_components(num_vertices, edges):
     """
-    Backtracking algorithm to find a path from the first current_node to target
+    Splits a (multi)graph into its biconnected components (blocks) with an
+    iterative version of Tarjan's algorithm. O(V+E) and no recursion, so long
+    chains of components are not a problem.
+    Any two vertices of a block with at least two edges lie on a common cycle.
+    Parallel edges count as a cycle, e.g. Wire(0, 1) and Wire(1, 0).
     params:
-        Graph: G(V, E). structure of edges and vertices
-        target: int. index representing the goal node
-        current_node: int. index representing the node being considered
-        visited_nodes: list of nodes that have been visited
-        available_edges: list of edges that have not been traversed
+        num_vertices: int. number of vertices
+        edges: list of (start, end) pairs
     returns:
-        float. the total resistance of traversing the found loop.
-            -1 if no loop found
+        list of blocks. each block is a list of edge indices
     """
-
-    visited_nodes.append(current_node)
-
-
-    #print(visited_nodes, current_node, available_edges, [[target, current_node]])
-    #print(visited_nodes, current_node)
-    
-
-    global total_res
-    if subsetof([[target, current_node]], available_edges):
-        # can traverse to the target node; a valid loop has been formed
-        print("found a loop")
-        total_res += Graph.vertices[current_node].res
-        return total_res
-
-    if is_repeating(visited_nodes):
-        # no loop found
-        print("circuit is repeating: no loop")
-        return -1
-
-    if len(available_edges) == 0:
-        print("all edges traversed: no loop found")
-        return -1
-
-    next_node = None
-    current_edge = None
-    least_res = np.inf
-    # loop through all the available edges
-    for e in available_edges:
-        # TODO: prioritize the path of least resistance instead of just taking
-        # available edge that connects to current_node.
-        if current_node in e:
-            opposite_e = e[~e.index(current_node)+2]
-            if Graph.vertices[opposite_e].res < least_res:
-                next_node = opposite_e
-                current_edge = e
-                least_res = Graph.vertices[opposite_e].res
-
-                if least_res == 0:
-                    # no need to keep looking further
+    adj = adjacency_list(num_vertices, edges)
+    disc = [-1] * num_vertices # discovery time of each vertex
+    low = [0] * num_vertices # lowest discovery time reachable from the subtree
+    blocks = []
+    edge_stack = []
+    time = 0
+
+    for root in range(num_vertices):
+        if disc[root] != -1:
+            continue
+        disc[root] = low[root] = time
+        time += 1
+        # (vertex, edge used to reach it, iterator over its neighbours)
+        stack = [(root, -1, iter(adj[root]))]
+
+        while stack:
+            v, parent_edge, neighbours = stack[-1]
+            descended = False
+            for w, e in neighbours:
+                if e == parent_edge:
+                    continue
+                if disc[w] == -1:
+                    # tree edge
+                    edge_stack.append(e)
+                    disc[w] = low[w] = time
+                    time += 1
+                    stack.append((w, e, iter(adj[w])))
+                    descended = True
                     break
-
-    if next_node != None:
-        #visited_nodes.append(current_node)
-        total_res += Graph.vertices[current_node].res
-        available_edges.pop(available_edges.index(current_edge))
-        
-        #print('moving to', next_node, visited_nodes)
-        
-        return backtracker(Graph, target, next_node, visited_nodes, available_edges)
-
-    # No viable next node found; have to backtrack
-    next_node = visited_nodes[-2]
-    # print("backtracking to", next_node)
-    # Remove the last two elements from visited_nodes so the backtracker doesn't
-    # get stuck
-    visited_nodes.pop()
-    visited_nodes.pop()
-    # Subtract the cost of the next node so that it is not double added
-    total_res -= Graph.vertices[next_node].res
-    # TODO: could return an array instead and compute cost from that
-    return backtracker(Graph, target, next_node, visited_nodes, available_edges)
+                elif disc[w] < disc[v]:
+                    # back edge
+                    edge_stack.append(e)
+                    low[v] = min(low[v], disc[w])
+            if descended:
+                continue
+
+            stack.pop()
+            if stack:
+                u = stack[-1][0]
+                low[u] = min(low[u], low[v])
+                if low[v] >= disc[u]:
+                    # u separates v's subtree: everything above the tree edge
+                    # (u, v) forms a block
+                    block = []
+                    while True:
+                        e = edge_stack.pop()
+                        block.append(e)
+                        if e == parent_edge:
+                            break
+                    blocks.append(block)
+
+    return blocks
+
+
+def closed_loop_sources(num_vertices, edges, res, sources):
+    """
+    Finds the emf sources that sit on a closed loop with non-zero resistance.
+    A source is on such a loop if it shares a block (with at least two edges)
+    with a component that has resistance. O(V+E).
+    params:
+        num_vertices: int. number of vertices
+        edges: list of (start, end) pairs
+        res: list of the resistances of the vertices
+        sources: list of the indices of the emf sources
+    returns:
+        sorted list of the sources that are on a closed loop
+    """
+    is_source = [False] * num_vertices
+    for s in sources:
+        is_source[s] = True
+
+    found = set()
+    for block in biconnected_components(num_vertices, edges):
+        if len(block) < 2:
+            continue # a bridge is not part of a loop
+        vertices = set()
+        for e in block:
+            vertices.update(edges[e])
+        if any(res[v] > 0 for v in vertices):
+            found.update(v for v in vertices if is_source[v])
+
+    return sorted(found)
@@ -0,0 +1,194 @@
+"""
+Benchmarks the simulation on generated circuits of increasing size. The
+circuits are built and simulated by Circuit itself, with a profiling.Profiler
+timing every phase so that it is clear where a Circuit slows down:
+* validate, add_nulls, add_junctions, compile: Circuit.build
+* assembly: the matrix and right-hand side of the nodal analysis
+* factorize: factoring the matrix (once, the circuits don't change)
+* solve: solving every step
+* write_back: putting the solutions into the components (scatter, advance)
+* calc_reading, record: multimeters and recording the step
+
+The results are written as JSON so that runs can be compared over time.
+
+Usage: python benchmark.py [output .json] [size ...]
+"""
+import json
+import platform
+import random
+import sys
+import numpy as np
+from components import *
+from circuit import Circuit
+from profiling import Profiler
+from solvers import load_scipy
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+DEFAULT_STEPS = 10
+DEFAULT_OUTPUT = "benchmark.json"
+
+
+def ladder(size):
+    """
+    An RC ladder: a battery feeding sections of a series resistor and a
+    capacitor to the bottom rail
+    params:
+        size: int. roughly the number of components
+    return:
+        V, E: the arguments of Circuit
+    """
+    V = [DC_Battery(10)]
+    E = []
+    top, bottom = 0, 0 # the battery connects the two rails
+    for k in range(max(size // 4, 1)):
+        V.append(Resistor(1 + k % 5))
+        E.append(Wire(top, len(V) - 1))
+        V.append(Junction(3))
+        E.append(Wire(len(V) - 2, len(V) - 1))
+        top = len(V) - 1
+
+        V.append(Capacitor(10 + k % 7))
+        E.append(Wire(top, len(V) - 1))
+        V.append(Junction(3))
+        E.append(Wire(len(V) - 2, len(V) - 1))
+        E.append(Wire(bottom, len(V) - 1))
+        bottom = len(V) - 1
+    # close the last section
+    V.append(Resistor(1))
+    E.append(Wire(top, len(V) - 1))
+    E.append(Wire(len(V) - 1, bottom))
+    return V, E
+
+
+def mesh(size):
+    """
+    A square grid of Junctions with a resistor on every edge, a battery on one
+    of them and a capacitor on every tenth
+    params: see ladder
+    """
+    k = max(int(np.sqrt(size / 3.)), 2)
+    V = [Junction(4) for _ in range(k * k)]
+    E = []
+    count = 0
+    for r in range(k):
+        for c in range(k):
+            for dr, dc in [(0, 1), (1, 0)]:
+                if r + dr >= k or c + dc >= k:
+                    continue
+                if count == 0:
+                    V.append(DC_Battery(10))
+                elif count % 10 == 0:
+                    V.append(Capacitor(10))
+                else:
+                    V.append(Resistor(1 + count % 5))
+                count += 1
+                E.append(Wire(r * k + c, len(V) - 1))
+                E.append(Wire(len(V) - 1, (r + dr) * k + c + dc))
+    return V, E
+
+
+def random_graph(size, seed=0):
+    """
+    A random connected graph of nodes with a component on every edge: a random
+    spanning tree plus extra edges that close loops. The battery and the
+    capacitors are on the tree and the extra edges are resistors, so there are
+    no loops of sources only (their currents would be undetermined). Like in
+    real netlists, edges
+    mostly connect nodes that are close to each other (in index); completely
+    random graphs make every sparse factorization fill in
+    params:
+        size: see ladder
+        seed: optional. seed of the generator
+    """
+    rng = random.Random(seed)
+    num_nodes = max(size // 3, 3)
+    near = lambda v: max(v - rng.randrange(1, 20), 0)
+    pairs = [(near(v), v) for v in range(1, num_nodes)]
+    pairs += [(near(v), v) for v in \
+              [rng.randrange(1, num_nodes) for _ in range(max(size - len(pairs), 1))]]
+    pairs = [p for p in pairs if p[0] != p[1]]
+
+    degree = [0] * num_nodes
+    for a, b in pairs:
+        degree[a] += 1
+        degree[b] += 1
+    V = [Junction(max(d, 2)) for d in degree]
+    E = []
+    for e in range(len(pairs)):
+        if e == 0:
+            V.append(DC_Battery(10))
+        elif e < num_nodes - 1 and rng.random() < 0.1:
+            V.append(Capacitor(rng.uniform(1, 100)))
+        else:
+            V.append(Resistor(rng.uniform(1, 10)))
+        E.append(Wire(pairs[e][0], len(V) - 1))
+        E.append(Wire(len(V) - 1, pairs[e][1]))
+    return V, E
+
+
+TOPOLOGIES = {"ladder": ladder, "mesh": mesh, "random": random_graph}
+
+
+def run_phases(V, E, steps=DEFAULT_STEPS, dt=1e-4, solver="auto"):
+    """
+    Builds and simulates a circuit with Circuit.build and Circuit.simulate,
+    timing every phase with a Profiler
+    params:
+        V, E: the arguments of Circuit
+        steps: optional. number of forward Euler steps
+        dt: optional. time step
+        solver: optional. see solvers.py
+    return:
+        dict. see the keys below. the phases are in seconds
+    """
+    profiler = Profiler()
+    circ = Circuit(V, E, dt, steps, solver, simulate=False, log=None, \
+                   plot=False, profiler=profiler)
+    if not circ.build():
+        raise ValueError("Generated circuit is not valid")
+    circ.simulate()
+
+    phases = dict(profiler.times)
+    return {"components": circ.lenv, "steps": steps, "phases": phases, \
+            "unknowns": circ.lenv - 1, "nnz": max(profiler.nnz, default=0), \
+            "total": sum(phases.values())}
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, topologies=None, steps=DEFAULT_STEPS, \
+                  solver="auto", log=print):
+    """
+    Runs every topology at every size
+    params:
+        sizes: optional. list of the approximate numbers of components
+        topologies: optional. list of names in TOPOLOGIES. defaults to all
+        steps: optional. see run_phases
+        solver: optional. see solvers.py
+        log: optional. callable that receives a line per run. None for silence
+    return:
+        dict. the environment and a list of results. see run_phases
+    """
+    load_scipy() # not part of any phase
+    results = []
+    for name in topologies if topologies is not None else list(TOPOLOGIES):
+        for size in sizes:
+            V, E = TOPOLOGIES[name](size)
+            result = run_phases(V, E, steps, solver=solver)
+            result.update({"topology": name, "size": size})
+            results.append(result)
+            if log is not None:
+                log("{0} {1}: {2} components, {3:0.3f} s ({4})".format( \
+                    name, size, result["components"], result["total"], \
+                    ", ".join("{0} {1:0.3f}".format(p, t) \
+                              for p, t in result["phases"].items())))
+    return {"python": platform.python_version(), "numpy": np.__version__, \
+            "machine": platform.machine(), "steps": steps, "solver": solver, \
+            "results": results}
+
+
+if __name__ == "__main__":
+    out = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_OUTPUT
+    sizes = [int(s) for s in sys.argv[2:]] or DEFAULT_SIZES
+    report = run_benchmark(sizes)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=1)
+    print("Results written to", out)
@@ -0,0 +1,152 @@
+"""
+Caching of simulation results, so that running the same circuit with the same
+settings again returns the stored waveforms instead of simulating it again.
+
+Results are keyed by fingerprint(): a SHA-256 hash of the component types and
+parameters, the Wire pairs, the ground node and the time settings, computed
+from the same arrays as the circuit files (see circuit_file.py). Recently used
+results are kept in memory; with a directory, every result is also written to
+"<key>.npz" there and the least recently used files are deleted once the
+directory grows past its size limit. Pass a ResultCache to Circuit:
+
+    cache = ResultCache(path=".circuit_cache")
+    circ = Circuit(V, E, dt, n, cache=cache)
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+from components import Junction
+from circuit_file import FORMAT_VERSION, components_to_arrays
+
+# the arrays of a result
+FIELDS = ["t", "v", "i", "reading"]
+
+
+def fingerprint(V, E, dt, n, **settings):
+    """
+    Canonical hash of a circuit and its time settings
+    params:
+        V: list or array of Components
+        E: list or array of Wires
+        dt, n: time step and number of steps
+        settings: optional. anything else the results depend on, e.g. the
+            integration method. must be JSON serializable
+    return:
+        str. hex digest
+    """
+    kind, params, edges = components_to_arrays(V, E)
+    grounds = [i for i in range(len(V)) \
+               if isinstance(V[i], Junction) and V[i].is_ground]
+    h = hashlib.sha256()
+    # adding 0. turns -0. into 0. so that equal values hash the same
+    for a in [kind, params + 0., edges]:
+        h.update(np.asarray(a.shape, dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(a).tobytes())
+    h.update(json.dumps({"format": FORMAT_VERSION, "grounds": grounds, \
+                         "dt": float(dt), "n": int(n), "settings": settings}, \
+                        sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of simulation results: an LRU in memory and, optionally, a
+    directory of .npz files with a size limit. A result is a dict of the
+    arrays in FIELDS: the times of the steps and the (steps, components)
+    voltages, currents and multimeter readings
+    """
+    def __init__(self, size=32, path=None, max_bytes=256 * 2**20):
+        """
+        params:
+            size: optional. number of results kept in memory
+            path: optional. str. directory of the on-disk tier. None keeps
+                the results in memory only
+            max_bytes: optional. size limit of the directory. the least
+                recently used files are deleted above it
+        """
+        self.size = size
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def file(self, key):
+        """Path of the file of a result"""
+        return os.path.join(self.path, key + ".npz")
+
+    def get(self, key):
+        """
+        params:
+            key: str. see fingerprint
+        return:
+            dict of the result, or None if it is not cached
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return self.memory[key]
+        if self.path is not None and os.path.isfile(self.file(key)):
+            with np.load(self.file(key)) as data:
+                result = {f: data[f] for f in FIELDS}
+            # the modification time is the last use. see evict
+            os.utime(self.file(key))
+            self.remember(key, result)
+            self.hits += 1
+            return result
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """
+        Stores a result in memory and, if there is a directory, on disk
+        params:
+            key: str. see fingerprint
+            result: dict of the arrays in FIELDS
+        """
+        result = {f: np.array(result[f]) for f in FIELDS}
+        self.remember(key, result)
+        if self.path is None:
+            return
+        # written under another name first so that a half written file is
+        # never read
+        tmp = self.file(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **result)
+        os.replace(tmp, self.file(key))
+        self.evict()
+
+    def remember(self, key, result):
+        """Puts a result in memory, forgetting the least recently used one if
+        there are too many"""
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def evict(self):
+        """Deletes the least recently used files until the directory is within
+        max_bytes"""
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith(".npz"):
+                st = os.stat(os.path.join(self.path, name))
+                files.append((st.st_mtime, st.st_size, name))
+        total = sum(f[1] for f in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+    def clear(self):
+        """Forgets every result, in memory and on disk"""
+        self.memory.clear()
+        if self.path is not None:
+            for name in os.listdir(self.path):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.path, name))
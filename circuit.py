@@ -1,10 +1,17 @@
+from collections import namedtuple
+from contextlib import nullcontext
 import numpy as np
-from numpy.linalg import solve
-# import scipy as sc
-# from scipy.sparse.linalg import spsolve TODO
-import matplotlib.pyplot as plt
 from components import *
-from algorithms import backtracker
+from algorithms import closed_loop_sources
+from solvers import Factorization, refactor, pick_backend
+from reduction import ReducedSystem
+from waveforms import Waveforms, WaveformSink
+from state import CircuitState
+from integrators import Integrator, ExactIntegrator, METHODS, propagator
+from ac import frequency_response
+
+# what Circuit.steps() yields for every step
+Step = namedtuple("Step", ["index", "time", "v", "i"])
 
 class Circuit:
     """
@@ -12,45 +19,555 @@ class Circuit:
     Vertices are Components and Edges are Wires.
     This is the class that takes care of all the calculations and simulation
     """
-    def __init__(self, V, E, dt=0.01, n=100):
+    def __init__(self, V, E, dt=0.01, n=100, solver="auto", simulate=True, \
+                 log=print, plot=True, reduce=False, profiler=None, cache=None):
         """
         params:
             V: list or array of Components
             E: list or array of Wires
             dt: time step of simulation
             n: number of steps for the simulation
+            solver: optional. linear solver backend: "dense", "sparse" or
+                "auto" (sparse for large circuits). see solvers.py
+            simulate: optional. whether to build, simulate and report right
+                away. if False, call build() and simulate() (or
+                simulate_batch()) yourself
+            log: optional. callable that receives every message of the
+                circuit, e.g. print or logging.getLogger(...).info. None
+                silences the circuit
+            plot: optional. whether report() graphs the results. matplotlib
+                is only imported when graphing
+            reduce: optional. whether to solve a reduced system in which
+                shorts are merged and series resistances combined. see
+                reduction.py. the results are the same
+            profiler: optional. class profiling.Profiler object that times
+                the phases of building and simulating
+            cache: optional. class cache.ResultCache object. simulate() returns
+                the stored results of an identical circuit instead of running
         """
-        self.vertices = V
-        self.edges = E
+        # plain lists so that components and wires are added in O(1). see
+        # add_edge and remove_vertex
+        self.vertices = list(V)
+        self.edges = list(E)
 
         self.t_step = dt
         self.num_steps = n
-
+        self.solver = solver
+        self.reduce = reduce
+        self.profiler = profiler
+        self.cache = cache
+        self.log = log
+        self.plot = plot
+        # where run() stores the results of each step. see simulate()
+        self.waveforms = None
+        self.recorder = None
+        # the Integrator (or ExactIntegrator) of the last run that wasn't
+        # forward Euler
+        self.integrator = None
+        # whether build() has succeeded
+        self.is_built = False
+        # arrays of the component values. see compile()
+        self.state = None
+        # cached factorization of the nodal analysis matrix. see factorize()
+        self.factor = None
+        self.factor_key = None
+        # the last full factorization and the state version it was made at.
+        # small changes since then are low-rank updates of it
+        self.factor_base = None
+        self.base_version = 0
+
+        self.index_edges()
         self.update_comp_cxns() # necessary when loading from file
 
-        if self.validate():
+        if simulate and self.build():
             # If the circuit is valid, then run all the calculations
+            self.print_circuit_data(ignore=[], w=True)
+            self.simulate()
+            self.report()
 
-            if not self.contains([Capacitor]):
-                # Simulation won't be necessary when the circuit doesn't contain
-                # a capacitor
-                self.t_step = 0
-                self.num_steps = 1
-                self.t_hist = np.array([1])
-            else:
-                self.t_hist = np.linspace(0.0, self.t_step*self.num_steps, self.num_steps)
+    def phase(self, name):
+        """Times a block with the profiler, if there is one. see profiling.py"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name)
+
+    def message(self, msg):
+        """Passes a message to the log, if there is one"""
+        if self.log is not None:
+            self.log(msg)
+
+    def build(self):
+        """
+        Validates the circuit and prepares it for simulation
+        return:
+            bool. whether the circuit is valid
+        """
+        if self.is_built:
+            return True
+        with self.phase("validate"):
+            valid = self.validate()
+        if not valid:
+            return False
+
+        if not self.contains([Capacitor, Inductor]):
+            # Simulation won't be necessary when the circuit doesn't contain
+            # a capacitor or an inductor
+            self.t_step = 0
+            self.num_steps = 1
+            self.times = np.array([1])
+        else:
+            # computed on demand. see t_hist
+            self.times = None
 
-            # Add components that are necessary for functionality
+        # Add components that are necessary for functionality
+        with self.phase("add_nulls"):
             self.add_nulls()
+        with self.phase("add_junctions"):
             self.add_junctions()
 
-            self.print_circuit_data(ignore=[], w=True)
+        with self.phase("compile"):
+            self.compile()
+        self.is_built = True
+        return True
 
-            for _ in range(self.num_steps):
-                self.run()
+    @property
+    def t_hist(self):
+        """Times of the steps. Computed when needed so that long runs don't
+        have to keep them"""
+        if self.times is not None:
+            return self.times
+        return np.linspace(0.0, self.t_step*self.num_steps, self.num_steps)
+
+    def step_time(self, k):
+        """Time of step k (t_hist[k]) without building t_hist"""
+        if self.times is not None:
+            return self.times[k]
+        if self.num_steps < 2:
+            return 0.
+        return self.t_step * self.num_steps * k / (self.num_steps - 1)
+
+    def simulate(self, stream=None, every=1, probes=None, chunk=4096, \
+                 method="euler", adaptive=False, rtol=1e-3, atol=1e-6):
+        """
+        Runs all the steps of the simulation. The circuit must be built
+        params:
+            stream: optional. str. path of a .npy file to stream the results
+                to instead of keeping them in memory. see
+                waveforms.WaveformSink. the components' histories stay empty
+            every: optional. when streaming, keep every k-th step
+            probes: optional. when streaming, indices of the components to
+                keep. defaults to all of them
+            chunk: optional. when streaming, rows buffered between writes
+            method: optional. "euler" (fixed steps of dt, the default),
+                "backward_euler", "trapezoidal" or "exact" (matrix
+                exponentials, needs scipy). see integrators.py. the other
+                methods also record the initial state at t = 0
+            adaptive: optional. with an implicit method, choose the step size
+                from the local truncation error instead of always using dt. dt
+                is the initial step and the run ends at dt * n
+            rtol, atol: optional. tolerances of the adaptive step size control
+        """
+        key = None
+        if self.cache is not None and stream is None:
+            # the cache is only imported when it is used
+            from cache import fingerprint
+            settings = {"method": method}
+            if adaptive:
+                settings.update(adaptive=True, rtol=rtol, atol=atol)
+            with self.phase("cache"):
+                key = fingerprint(self.vertices, self.edges, self.t_step, \
+                                  self.num_steps, **settings)
+                result = self.cache.get(key)
+            if result is not None:
+                self.restore(result)
+                return
+
+        for _ in self.steps(stream, every, probes, chunk, method, adaptive, \
+                            rtol, atol):
+            pass
+        if key is not None:
+            w = self.waveforms
+            self.cache.put(key, {"t": self.t_hist, "v": w.v[:w.n], \
+                                 "i": w.i[:w.n], "reading": w.reading[:w.n]})
+
+    def restore(self, result):
+        """
+        Puts the circuit in the state a simulation ended in, from its stored
+        results. see cache.py
+        params:
+            result: dict. "t", "v", "i" and "reading", the times and the
+                (steps, components) histories of the simulation
+        """
+        n = len(result["t"])
+        self.waveforms = Waveforms(n, self.lenv)
+        self.waveforms.v[:] = result["v"]
+        self.waveforms.i[:] = result["i"]
+        self.waveforms.reading[:] = result["reading"]
+        self.waveforms.n = n
+        self.waveforms.attach(self.vertices)
+        self.recorder = self.waveforms
+        self.times = np.array(result["t"])
+        self.integrator = None
+
+        if n > 0:
+            self.state.emf[:] = self.waveforms.v[-1]
+            self.state.curr[:] = self.waveforms.i[-1]
+            for i in self.state.meters:
+                self.vertices[i].reading = self.waveforms.reading[-1, i]
+        for i in self.state.bulbs:
+            self.vertices[i].update_state(None)
+
+    def steps(self, stream=None, every=1, probes=None, chunk=4096, \
+              method="euler", adaptive=False, rtol=1e-3, atol=1e-6):
+        """
+        Runs the simulation one step at a time. The circuit must be built.
+        Stopping early (break, or closing the generator) is fine: the histories
+        and t_hist then only cover the steps that were run.
+        params: see simulate()
+        yields:
+            Step(index, time, v, i). v and i are the voltages and currents of
+            every component. they are views that the next step overwrites, so
+            copy them to keep them
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown integration method", method)
+        integrator = None
+        if adaptive and method in ["euler", "exact"]:
+            raise ValueError("Adaptive steps need an implicit method")
+        if method == "exact":
+            integrator = ExactIntegrator(self)
+            self.integrator = integrator
+        elif method != "euler":
+            integrator = Integrator(self, method, adaptive, rtol, atol)
+            self.integrator = integrator
+
+        if self.t_step:
+            self.times = None # t_hist of an earlier run
+        if integrator is None:
+            times = self.step_time
+        else:
+            times = lambda k: integrator.t
+        if stream is None:
+            # preallocate the histories of every component. adaptive runs grow
+            # them if needed
+            self.waveforms = Waveforms(self.num_steps + 1, self.lenv)
+            self.waveforms.attach(self.vertices)
+            self.recorder = self.waveforms
+        else:
+            if probes is None:
+                probes = range(self.lenv)
+            self.waveforms = None
+            self.recorder = WaveformSink(stream, self.num_steps + 1, probes, \
+                                         every, chunk, times)
+
+        # number of steps recorded
+        count = 0
+        # the times of the steps are only kept when they can't be worked out
+        # afterwards, so streamed runs use the same memory however long they are
+        done = [] if stream is None and adaptive else None
+        try:
+            if integrator is None:
+                for k in range(self.num_steps):
+                    self.run()
+                    count += 1
+                    yield Step(k, self.step_time(k), self.state.emf, \
+                               self.state.curr)
+            else:
+                t = integrator.start()
+                while True:
+                    if done is not None:
+                        done.append(t)
+                    count += 1
+                    yield Step(count - 1, t, self.state.emf, self.state.curr)
+                    if integrator.finished:
+                        break
+                    t = integrator.step()
+        finally:
+            # keep t_hist as long as the histories
+            if stream is not None:
+                self.recorder.close()
+            elif done is not None:
+                self.times = np.array(done)
+            elif integrator is not None:
+                self.times = np.minimum(np.arange(count) * self.t_step, \
+                                        integrator.t_end)
+            elif count < self.num_steps:
+                self.times = self.t_hist[:count]
+            self.integrator = integrator
+
+    def simulate_batch(self, params):
+        """
+        Simulates many variants of the circuit's parameters at once. All the
+        variants share the topology, so their systems are stacked and solved
+        together. The circuit must be built. The components themselves are not
+        changed and multimeter readings are not recorded.
+        params:
+            params: dict. {component index: {attribute: values}}. attribute is
+                "res", "emf" (battery voltage or initial capacitor voltage),
+                "cpty" (farads) or "L" (henries); values is array-like with one
+                value per variant. every values must have the same length K
+        return:
+            v, i: arrays of shape (K, num_steps, lenv). voltage and current of
+                every component at every step of every variant
+        """
+        st = self.state
+        values = {}
+        for idx in params:
+            for attr in params[idx]:
+                if attr not in ["res", "emf", "cpty", "L"]:
+                    raise ValueError("Parameter cannot be varied", attr)
+                values[(idx, attr)] = np.asarray(params[idx][attr], dtype=float)
+        k = len(next(iter(values.values()))) if values else 1
+
+        # one row per variant
+        arrays = {}
+        for attr in ["res", "emf", "cpty", "L"]:
+            arrays[attr] = np.tile(getattr(st, attr), (k, 1))
+        for (idx, attr), vals in values.items():
+            if len(vals) != k:
+                raise ValueError("Every parameter needs the same number of values")
+            arrays[attr][:, idx] = vals
+        emf, res, cpty, L = arrays["emf"], arrays["res"], arrays["cpty"], \
+                            arrays["L"]
+        curr = np.tile(st.curr, (k, 1))
 
-            self.print_circuit_data()
-            self.graph_circuit_data()
+        m_size = self.lenv - 1
+        rows, cols, vals = st.matrix(res)
+        if any(attr == "res" for (_, attr) in values):
+            # every variant has its own matrix
+            if pick_backend(self.solver, m_size) == "dense":
+                # invert them all once, so that a step is a single batched
+                # matmul. K dense LU factors would take as much memory
+                A = np.zeros((k, m_size, m_size))
+                np.add.at(A, (slice(None), rows, cols), vals)
+                inv_A = np.linalg.inv(A)
+                solve_all = lambda b: inv_A @ b
+            else:
+                # sparse: factor each of them once
+                factors = [Factorization(rows, cols, vals[j], m_size, \
+                                         "sparse") for j in range(k)]
+                solve_all = lambda b: np.stack([factors[j].solve(b[j]) \
+                                                for j in range(k)])
+        else:
+            # the matrix is shared: solve all the variants as columns of one
+            # right-hand side
+            factor = Factorization(rows, cols, vals[0], m_size, self.solver)
+            solve_all = lambda b: factor.solve(b[..., 0].T).T[..., None]
+
+        v_hist = np.zeros((k, self.num_steps, self.lenv))
+        i_hist = np.zeros((k, self.num_steps, self.lenv))
+        for step in range(self.num_steps):
+            x = solve_all(st.rhs(emf, curr))
+            st.scatter(x, emf, curr)
+            st.advance(self.t_step, emf, curr, res, cpty, L)
+            v_hist[:, step] = emf
+            i_hist[:, step] = curr
+
+        return v_hist, i_hist
+
+    def operating_point(self, apply=False):
+        """
+        DC operating point: the state the circuit settles in. Capacitors are
+        treated as open circuits and inductors as shorts, so it takes a single
+        linear solve instead of
+        stepping until the circuit has settled. The circuit must be built.
+        Circuits whose final state depends on the initial charges (capacitors
+        without a DC path to the rest of the circuit) or currents (loops of
+        inductors) don't have one; solving then raises
+        numpy.linalg.LinAlgError.
+        params:
+            apply: optional. whether to put the components in this state, e.g.
+                to start a simulation from steady state
+        return:
+            v, i: arrays of shape (lenv,). voltage and current of every
+                component
+        """
+        st = self.state
+        caps = st.capacitors
+        closed = st.closed.copy()
+        closed[caps] = False
+        emf = st.emf.copy()
+        emf[caps] = 0.
+        curr = st.curr.copy()
+        # no voltage drop across the inductors. see CircuitState.matrix
+        short = np.zeros(self.lenv)
+
+        if self.reduce:
+            factor = ReducedSystem(st, short, closed, self.solver)
+        else:
+            rows, cols, vals = st.matrix(companion=short, closed=closed)
+            factor = Factorization(rows, cols, vals, self.lenv - 1, self.solver)
+        x = factor.solve(st.rhs(emf, short))
+        st.scatter(x, emf, curr)
+        st.settle(emf, curr, st.res)
+        # the capacitors charge up to the voltage across their terminals
+        emf[caps] = emf[st.cxn[caps, 1]] - emf[st.cxn[caps, 0]]
+
+        if apply:
+            st.emf[:] = emf
+            st.curr[:] = curr
+        return emf, curr
+
+    def ac_analysis(self, freqs, source=None):
+        """
+        Small-signal analysis: the steady-state response to a sinusoidal
+        source of amplitude 1V at every frequency, in one call instead of a
+        transient run per frequency. The other batteries are shorted. The
+        circuit must be built. see ac.py
+        params:
+            freqs: array-like. frequencies in Hz
+            source: optional. index of the battery that drives the circuit.
+                defaults to the first battery
+        return:
+            v, i: complex arrays of shape (len(freqs), lenv). e.g.
+                ac.bode(v[:, k]) is the Bode plot of component k
+        """
+        return frequency_response(self.state, freqs, source, self.solver)
+
+    def state_matrix(self):
+        """
+        The matrix M of dy/dt = M y (+ sources) where y are the capacitor
+        voltages and then the inductor currents. Column j holds the rates of
+        change when state variable j is 1 (V or A) and every other one and
+        every battery is 0. The circuit must be built
+        return:
+            array of shape (num variables, num variables)
+        """
+        return self.state_space()[0]
+
+    def state_space(self):
+        """
+        The circuit as a linear time-invariant system
+            dy/dt = A y + B u
+            z = C y + D u
+        y are the state variables (see CircuitState.variables), u the battery
+        voltages (in the order of CircuitState.batteries) and z the voltages
+        and then the currents of every component. Column j of every matrix is
+        the result of setting y or u to 1 at j and everything else to 0, so
+        it takes one solve with a column per variable and battery. The
+        circuit must be built
+        return:
+            A: array of shape (num variables, num variables)
+            B: array of shape (num variables, num batteries)
+            C: array of shape (2 * lenv, num variables)
+            D: array of shape (2 * lenv, num batteries)
+        """
+        st = self.state
+        caps, inds, bats = st.capacitors, st.inductors, st.batteries
+        c, l = len(caps), len(inds)
+        k = c + l + len(bats)
+        # one row per unit input
+        emf = np.zeros((k, self.lenv))
+        curr = np.zeros((k, self.lenv))
+        emf[np.arange(c), caps] = 1.
+        curr[c + np.arange(l), inds] = 1.
+        emf[c + l + np.arange(len(bats)), bats] = 1.
+        emf, curr = self.solve_sources(emf, curr)
+
+        rates = np.concatenate([curr[:, caps] / st.cpty[caps], \
+                                emf[:, inds] / st.L[inds]], axis=1).T
+        z = np.concatenate([emf, curr], axis=1).T
+        return rates[:, :c+l], rates[:, c+l:], z[:, :c+l], z[:, c+l:]
+
+    def solve_sources(self, emf, curr=None):
+        """
+        Solves the circuit for many values of its sources at once: the
+        factorization of run() is reused and every configuration is a column
+        of one right-hand side. The circuit is not changed. The circuit must be
+        built
+        params:
+            emf: array-like of shape (K, lenv). the battery and capacitor
+                voltages of every configuration. the other entries are ignored
+            curr: optional. array-like of shape (K, lenv). the inductor
+                currents. defaults to 0
+        return:
+            v, i: arrays of shape (K, lenv)
+        """
+        st = self.state
+        emf = np.array(emf, dtype=float, ndmin=2)
+        if curr is None:
+            curr = np.zeros(emf.shape)
+        else:
+            curr = np.array(curr, dtype=float, ndmin=2)
+        factor = self.factorize()
+        with self.phase("solve"):
+            x = factor.solve(st.rhs(emf, curr)[..., 0].T)
+        with self.phase("write_back"):
+            st.scatter(x.T[..., None], emf, curr)
+            st.settle(emf, curr, st.res)
+        return emf, curr
+
+    def contributions(self):
+        """
+        Superposition: what every battery contributes to the present solution,
+        with one solve. The circuit is linear, so the rows add up to the
+        voltages and currents the circuit has now, and any other combination
+        of battery voltages is a weighted sum of them (e.g. w @ v). The
+        circuit must be built
+        return:
+            v, i: arrays of shape (num batteries + 1, lenv). row k is battery k
+                (see CircuitState.batteries) at its voltage with the others
+                shorted and the capacitors and inductors at 0. the last row is
+                the capacitors and inductors with every battery shorted
+        """
+        st = self.state
+        bats = st.batteries
+        k = len(bats)
+        emf = np.zeros((k + 1, self.lenv))
+        curr = np.zeros((k + 1, self.lenv))
+        emf[np.arange(k), bats] = st.emf[bats]
+        emf[k, st.capacitors] = st.emf[st.capacitors]
+        curr[k, st.inductors] = st.curr[st.inductors]
+        return self.solve_sources(emf, curr)
+
+    def response(self, times):
+        """
+        The voltages and currents at any times from the current state, in
+        closed form: every time costs one matrix exponential, no matter how
+        far ahead it is. The batteries keep their voltages. The circuit must be
+        built; it is not changed. Needs scipy
+        params:
+            times: array-like. times in seconds from now
+        return:
+            v, i: arrays of shape (len(times), lenv)
+        """
+        st = self.state
+        A, B, C, D = self.state_space()
+        Phi, Gamma = propagator(A, B, np.atleast_1d(times))
+        u = st.emf[st.batteries]
+        y = Phi @ st.variables() + Gamma @ u
+        z = y @ C.T + D @ u
+        return z[:, :self.lenv], z[:, self.lenv:]
+
+    def time_constants(self):
+        """
+        The time constants of the circuit, from the eigenvalues of its state
+        matrix. see state_matrix
+        return:
+            sorted array. modes that never decay (e.g. two capacitors with
+            nothing but wires in between) are left out
+        """
+        if len(self.state.capacitors) + len(self.state.inductors) == 0:
+            return np.array([])
+        rates = -np.linalg.eigvals(self.state_matrix()).real
+        return np.sort(1. / rates[rates > 1e-12])
+
+    def suggest_timing(self, steps_per_tau=20, settle=5):
+        """
+        Picks dt and n from the time constants: dt resolves the fastest one and
+        the run lasts until the slowest one has settled
+        params:
+            steps_per_tau: optional. steps per the smallest time constant
+            settle: optional. how many of the largest time constants to run for
+        return:
+            dt: float
+            n: int
+        """
+        taus = self.time_constants()
+        if len(taus) == 0:
+            return 0, 1
+        dt = taus[0] / steps_per_tau
+        return dt, int(np.ceil(settle * taus[-1] / dt))
 
     @property
     def lenv(self):
@@ -61,6 +578,37 @@ class Circuit:
         """Reformats the edges for ease-of-use with some algorithms"""
         return list(map(lambda e: e.pair, self.edges))
 
+    def index_edges(self):
+        """Builds the lookups of the wires: the position of every wire in
+        self.edges and the wires at every component"""
+        self.edge_pos = {}
+        self.wires_at = [[] for _ in range(self.lenv)]
+        for pos in range(len(self.edges)):
+            w = self.edges[pos]
+            self.edge_pos[w] = pos
+            self.wires_at[w.start].append(w)
+            if w.end != w.start:
+                self.wires_at[w.end].append(w)
+
+    def add_edge(self, wire):
+        """Adds a wire in O(1)"""
+        self.edge_pos[wire] = len(self.edges)
+        self.edges.append(wire)
+        self.wires_at[wire.start].append(wire)
+        if wire.end != wire.start:
+            self.wires_at[wire.end].append(wire)
+
+    def remove_edge(self, wire):
+        """Removes a wire in O(1): the last wire takes its place"""
+        pos = self.edge_pos.pop(wire)
+        last = self.edges.pop()
+        if last is not wire:
+            self.edges[pos] = last
+            self.edge_pos[last] = pos
+        self.wires_at[wire.start].remove(wire)
+        if wire.end != wire.start:
+            self.wires_at[wire.end].remove(wire)
+
     def add_component(self, c, wire, args=[]):
         """
         Adds a component to the Circuit at a given point.
@@ -69,14 +617,19 @@ class Circuit:
             wire: class Wire object in between which the component is to be
                 added.
             args: optional. additional arguments required for the creation of c
+        return:
+            the two new Wires. see split_wire
         """
         # create the new component
         new_comp = c(*args)
         new_comp.add_connection(wire.start)
         new_comp.add_connection(wire.end)
-        self.vertices = np.append(self.vertices, new_comp)
+        self.vertices.append(new_comp)
+        self.wires_at.append([])
+        # the topology changed
+        self.state = None
 
-        self.split_wire(wire, self.lenv-1)
+        return self.split_wire(wire, self.lenv-1)
 
     def split_wire(self, wire, new_conn):
         """
@@ -84,25 +637,143 @@ class Circuit:
         params:
             wire: class Wire object to be split
             new_conn: int. index of the component that is to be added in between.
+        return:
+            the two new Wires: start to new_conn and new_conn to end
         """
         # configure the old components' connections
         self.vertices[wire.start].change_connection(wire.end, new_conn)
         self.vertices[wire.end].change_connection(wire.start, new_conn)
 
-        # create the new wires
-        self.edges = np.append(self.edges, Wire(wire.start, new_conn))
-        self.edges = np.append(self.edges, Wire(new_conn, wire.end))
+        # replace the old wire with the new ones
+        self.remove_edge(wire)
+        halves = [Wire(wire.start, new_conn), Wire(new_conn, wire.end)]
+        for w in halves:
+            self.add_edge(w)
+        return halves
+
+    def remove_vertex(self, i):
+        """
+        Removes a component and its wires in O(degree). The last component
+        takes its place, so only its wires and neighbours are renumbered.
+        The CircuitState has to be recompiled afterwards. see recompile
+        params:
+            i: int. index of the component
+        """
+        for w in list(self.wires_at[i]):
+            other = w.end if w.start == i else w.start
+            self.vertices[other].rm_connection(i)
+            self.remove_edge(w)
+
+        last = self.lenv - 1
+        if i != last:
+            for w in self.wires_at[last]:
+                other = w.end if w.start == last else w.start
+                self.vertices[other].change_connection(last, i)
+                w.start = i if w.start == last else w.start
+                w.end = i if w.end == last else w.end
+                w.pair = (w.start, w.end)
+            self.vertices[i] = self.vertices[last]
+            self.wires_at[i] = self.wires_at[last]
+        self.vertices.pop()
+        self.wires_at.pop()
+        self.state = None
+
+    def insert_component(self, c, wire, args=[]):
+        """
+        Adds a component to a built Circuit without starting over. The other
+        components keep their values and histories and the matrix is
+        refactored once, so a simulation (e.g. a loop over steps()) simply
+        carries on with the new component. Junctions and Null_Components are
+        added around it as build() would
+        params: see add_component
+        return:
+            int. index of the new component
+        """
+        new = self.lenv
+        halves = self.add_component(c, wire, args)
+        if not self.is_built:
+            return new # build() takes care of the rest
+
+        for w in halves:
+            if isinstance(self.vertices[w.start], Junction) and \
+               isinstance(self.vertices[w.end], Junction):
+                self.add_component(Null_Component, w)
+            elif not self.connects_to(w, Junction):
+                self.add_component(Junction, w, [2])
+
+        if self.waveforms is not None:
+            self.waveforms.add_comps(self.lenv - new)
+        self.recompile()
+        return new
+
+    def remove_component(self, i):
+        """
+        Takes a two-terminal component out of a built Circuit, leaving its ends
+        open, without starting over (see insert_component). The last component
+        takes the index i. Junctions that are left without any connections are
+        removed as well. If that splits off a part of the circuit without the
+        ground, the next solve raises numpy.linalg.LinAlgError
+        params:
+            i: int. index of the component
+        return:
+            the removed Component. it keeps its values but not its histories
+        """
+        comp = self.vertices[i]
+        if isinstance(comp, Junction):
+            raise ValueError("Only two-terminal components can be removed", i)
+        if isinstance(self.recorder, WaveformSink):
+            # the probes of the stream are indices
+            raise ValueError("Components cannot be removed while streaming")
+
+        ends = list(comp.cxns)
+        comp.detach()
+        removed = [i]
+        self.remove_vertex(i)
+        # the last component took the place of the removed one
+        ends = [i if e == self.lenv else e for e in ends]
+        for k in range(len(ends)):
+            j = ends[k]
+            if isinstance(self.vertices[j], Junction) and not self.wires_at[j]:
+                if self.vertices[j].is_ground:
+                    self.pick_new_ground(j)
+                removed.append(j)
+                self.remove_vertex(j)
+                ends = [j if e == self.lenv else e for e in ends]
+        comp.cxns = np.ones(len(comp.cxns), dtype='int') * -1
+
+        if self.is_built:
+            if self.waveforms is not None:
+                for j in removed:
+                    self.waveforms.remove_comp(j)
+            self.recompile()
+        return comp
+
+    def pick_new_ground(self, old):
+        """Moves the ground to another Junction than old"""
+        for c in self.vertices:
+            if isinstance(c, Junction) and c is not self.vertices[old]:
+                self.vertices[old].is_ground = False
+                c.is_ground = True
+                return
 
-        # delete the old wire
-        self.edges = np.delete(self.edges, np.where(self.edges == wire))
+    def recompile(self):
+        """
+        Compiles the CircuitState again after components were added or
+        removed. The values are carried over from the old state
+        """
+        self.compile()
+        if self.waveforms is not None:
+            self.waveforms.attach(self.vertices)
+        if self.integrator is not None:
+            self.integrator.restart()
 
     def add_junctions(self):
         """
         Inserts a junction into each wire to serve as a node and to avoid
         2-component circuits from being labelled invalid
         """
-        start_len = len(self.edges)
-        for w in self.edges[0:start_len]:
+        # splitting wires changes self.edges, so go through a copy of it
+        for w in list(self.edges):
             if not self.connects_to(w, Junction):
                 self.add_component(Junction, w, [2])
 
@@ -115,7 +786,7 @@ class Circuit:
     def add_nulls(self):
         """Adds Null_Components to the Circuit so that no two Junctions are
         connected"""
-        for w in self.edges:
+        for w in list(self.edges):
             if isinstance(self.vertices[w.start], Junction) and \
                isinstance(self.vertices[w.end], Junction):
                 self.add_component(Null_Component, w)
@@ -133,107 +804,127 @@ class Circuit:
             * non-zero resistance
             * at least one source of emf
                 * doesn't have be a battery: could be a capacitor or an inductor
-        * recursive backtracking that there is a closed loop around the emf source
         * if there are components with less than 2 connections, immediately tell
         the user to complete the circuit
 
         How to accomplish this?
         1. Locate all emf sources (batteries, capacitors, inductors)
-        2. For each, keep calculating loops until a closed loop with non-zero
-        equivalent resistance is found
-            * When found, break and return True
-            * If not found, the circuit is not valid
-        """
-        for i in range(self.lenv):
-            # add isinstance(comp, Inductor) TODO
-            comp = self.vertices[i]
-            if isinstance(comp, DC_Battery) or isinstance(comp, Capacitor):
-                if backtracker(self, i, i, [], self.edge_tuples) > 0:
-                    print('valid')
-                    # reset total_res
-                    global total_res
-                    total_res = 0
-                    return True # circuit is valid
-        print("Circuit is not valid")
+        2. Split the circuit into biconnected blocks. A source is on a closed
+        loop with non-zero resistance if its block also contains a component
+        with resistance. see algorithms.closed_loop_sources
+        The sources that are on such a loop are stored in self.loop_sources
+        """
+        sources = [i for i in range(self.lenv) if isinstance(self.vertices[i], \
+                                                   (DC_Battery, Capacitor, Inductor))]
+        self.loop_sources = closed_loop_sources(self.lenv, self.edge_tuples, \
+                                                [c.res for c in self.vertices], \
+                                                sources)
+        if len(self.loop_sources) > 0:
+            self.message('valid')
+            return True # circuit is valid
+        self.message("Circuit is not valid")
         return False # circuit is not valid
 
-    def run(self):
-        """This is where all the nodal analysis takes place"""
-
-        # set up the matrices
-        m_size = self.lenv - 1
-        A = np.zeros((m_size, m_size))
-        b = np.zeros((m_size, 1))
-
-        # loop through all the nodes and components to fill the matrices
-        # will go over every component except for the ground node
-        for i in range(m_size):
-            comp = self.vertices[i]
-            if isinstance(comp, Junction):
-                # fill in the currents
-                # current into element: -1
-                # current out of element: 1
-                for conn in comp.cxns:
-                    A[i, conn] = self.get_curr_dir(i, conn)
-            else:
-                # voltages
-                v_drop = -1.
-
-                if type(comp) in [DC_Battery, Capacitor]:
-                    b[i] = comp.emf
-                    v_drop = 1.
-                elif type(comp) in [Resistor, Light_Bulb, Multimeter]:
-                    A[i, i] = comp.res
-
-                c1 = comp.cxns[0]
-                c2 = comp.cxns[1]
-                if not (isinstance(self.vertices[c1], Junction) and \
-                        self.vertices[c1].is_ground):
-                    A[i, c1] = -1. * v_drop
-                if not(isinstance(self.vertices[c2], Junction) and \
-                       self.vertices[c2].is_ground):
-                    A[i, c2] = 1. * v_drop
-
+    def compile(self):
+        """
+        Builds the struct-of-arrays representation of the components that all
+        the calculations are done on. Must be redone whenever the topology
+        changes
+        """
+        self.state = CircuitState(self.vertices)
+        self.factor = None
 
-        x = solve(A, b)
+    def assemble_matrix(self):
+        """
+        Fills the matrix of the nodal analysis. A only depends on the topology,
+        the resistances and the states of the switches, so it doesn't have to be
+        rebuilt every step.
+        return:
+            rows, cols, vals: arrays. A as COO triplets so that it never has to
+                be stored densely for large circuits
+        """
+        return self.state.matrix()
 
+    def assemble_rhs(self):
+        """Fills the right-hand side of the nodal analysis: the emf sources"""
+        return self.state.rhs()
 
-        # equate values of x with the components
-        for i in range(len(x)):
-            comp = self.vertices[i]
-            if isinstance(comp, Junction):
-                comp.emf = x[i, 0]
-            else:
-                comp.curr = x[i, 0]
-                comp.i_hist = np.append(comp.i_hist, x[i, 0])
-
-        # complete calculations
-        for i in range(self.lenv):
-            comp = self.vertices[i]
-
-            if isinstance(comp, Junction):
-                for conn in comp.cxns:
-                    comp.curr += self.vertices[conn].curr * self.get_curr_dir(i, conn)
-                comp.i_hist = np.append(comp.i_hist, comp.curr)
-            elif isinstance(comp, Capacitor):
-                comp.emf += comp.curr * self.t_step / comp.cpty
-            elif type(comp) in [Resistor, Light_Bulb, Multimeter]:
-                comp.emf = comp.curr * comp.res
-            else:
-                pass
+    def factorize(self):
+        """
+        (Re)factors the matrix of the nodal analysis if anything it depends on
+        has changed since the last factorization. When only a few components
+        changed (switches flipped, resistances changed), the last full
+        factorization is updated instead. see solvers.refactor
+        return:
+            class Factorization, LowRankUpdate or ReducedSystem object
+        """
+        st = self.state
+        key = (st, st.version)
+        if self.reduce and (self.factor is None or key != self.factor_key):
+            with self.phase("factorize"):
+                self.factor = ReducedSystem(st, backend=self.solver)
+            self.factor_key = key
+        elif self.factor is None or key != self.factor_key:
+            with self.phase("assembly"):
+                rows, cols, vals = self.assemble_matrix()
+            base, changed = None, []
+            if self.factor is not None and self.factor_key[0] is st:
+                base = self.factor_base
+                changed = st.changed_rows(self.base_version)
+            with self.phase("factorize"):
+                self.factor = refactor(base, rows, cols, vals, changed, \
+                                       self.lenv - 1, self.solver)
+            if isinstance(self.factor, Factorization) and self.factor is not base:
+                self.factor_base = self.factor
+                self.base_version = st.version
+            self.factor_key = key
+        return self.factor
 
-            comp.v_hist = np.append(comp.v_hist, comp.emf)
+    def run(self):
+        """
+        This is where all the nodal analysis takes place. One forward Euler
+        step; the other methods are in integrators.py
+        """
+        if self.state is None:
+            self.compile()
+
+        # only the emf sources change between steps, so the factorization of
+        # A is reused and only b is rebuilt
+        factor = self.factorize()
+        with self.phase("assembly"):
+            b = self.assemble_rhs()
+        with self.phase("solve"):
+            x = factor.solve(b)
+        if self.profiler is not None:
+            self.profiler.step(factor)
+
+        # equate values of x with the components and complete calculations
+        with self.phase("write_back"):
+            self.state.scatter(x)
+            self.state.advance(self.t_step)
+
+        self.finish_step()
+        return 0
 
+    def finish_step(self):
+        """Updates the multimeters and light bulbs and records the step"""
         # update multimeter readings and light bulb states
-        # this must be done after the previous for loop to guarantee that
+        # this must be done after the previous calculations to guarantee that
         # every component has all of its values
-        for c in self.vertices:
-            if isinstance(c, Multimeter):
-                c.calc_reading(self)
-            elif isinstance(c, Light_Bulb):
-                c.update_state()
-
-        return 0
+        reading = np.zeros(self.lenv)
+        for i in self.state.meters:
+            with self.phase("calc_reading"):
+                reading[i] = self.vertices[i].calc_reading(self)
+        for i in self.state.bulbs:
+            self.vertices[i].update_state(self.log)
+
+        if self.recorder is None:
+            # stepping by hand (run() after build()) records like simulate()
+            self.waveforms = Waveforms(self.num_steps + 1, self.lenv)
+            self.waveforms.attach(self.vertices)
+            self.recorder = self.waveforms
+        with self.phase("record"):
+            self.recorder.record(self.state.emf, self.state.curr, reading)
 
     def contains(self, types):
         """
@@ -266,55 +957,55 @@ class Circuit:
         return:
             int. the direction of current. -1: into component. 1: out of component
         """
-        if self.vertices[comp_name].cxns[0] == node_name:
-           return 1
-        elif self.vertices[comp_name].cxns[1] == node_name:
-           return -1
-        else: # just in case
-           raise ValueError("Components not connected", node_name, comp_name)
+        if self.state is not None and self.state.cxn[comp_name, 0] >= 0:
+            # the incidence table of the compiled topology. it is dropped
+            # whenever components are added or removed
+            d = self.state.direction(node_name, comp_name)
+        else:
+            ends = self.vertices[comp_name].cxns
+            d = 1 if ends[0] == node_name else (-1 if ends[1] == node_name else 0)
+        if d == 0: # just in case
+            raise ValueError("Components not connected", node_name, comp_name)
+        return int(d)
 
     def print_circuit_data(self, ignore=[Junction, Null_Component], w=False):
         """
-        Prints specified data of the circuit
+        Prints specified data of the circuit. see report.print_circuit_data
         params:
             ignore: list of component types not to be printed
             w: bool. whether the wires will be printed
         """
-        print("============")
-        print("Circuit Data")
-        print("============")
-        for i in range(self.lenv):
-            c = self.vertices[i]
-            if not type(c) in ignore:
-                print("{0} {1} I: {2:0.6f} V: {3:0.3f} R: {4:0.1f}".format(i, \
-                     type(c), c.curr, c.emf, c.res))
-
-        print("============")
-
-        if w:
-            for wire in self.edges:
-                print(wire.pair)
+        if self.log is None:
+            return
+        # the reporting module is only loaded when something is reported
+        from report import print_circuit_data
+        print_circuit_data(self, ignore, w)
+
+    def report(self):
+        """Prints the results and graphs them if plotting is enabled"""
+        self.print_circuit_data()
+        if self.plot:
+            self.graph_circuit_data()
+        if self.profiler is not None:
+            self.message(self.profiler.summary())
 
     def graph_circuit_data(self, comps=[Capacitor], vir=0):
         """
-        Graph data of certain components
+        Graph data of certain components. see report.graph_circuit_data
         params:
             comps: list. types to graph
             viq: int. Voltage (0), Current (1), Resistance (2)
         """
-        #TODO: Charge for Capacitors
-        #TODO: make subplots
-        if not self.contains(comps):
-            return 1 # nothing to graph
-        for c in self.vertices:
-            if type(c) in comps:
-                plt.plot(self.t_hist, [c.v_hist, c.i_hist, c.r_hist][vir])
-
-        plt.xlabel("Time (s)")
-        plt.ylabel(["Voltage (V)", "Current (I)", "Resistance ($\Omega$)"][vir])
-        plt.show()
-        return 0
+        from report import graph_circuit_data
+        with self.phase("plot"):
+            return graph_circuit_data(self, comps, vir)
 
     def update_comp_cxns(self):
-        for i in range(self.lenv):
-            self.vertices[i].update_connections(i, self.edges)
+        """Rebuilds the connections of every component from the wires. One pass
+        over the wires instead of one per component"""
+        for c in self.vertices:
+            c.cxns = np.ones(len(c.cxns), dtype='int') * -1
+        for w in self.edges:
+            self.vertices[w.start].add_connection(w.end)
+            if w.end != w.start:
+                self.vertices[w.end].add_connection(w.start)
@@ -0,0 +1,204 @@
+"""
+Reading and writing circuit files.
+
+A circuit is saved as a directory "<name>.circuit" holding plain .npy arrays
+(no pickles), so every array can be opened with np.load(mmap_mode="r"):
+* kind.npy: int8 (N,). type code of every component. see state.KINDS
+* params.npy: float64 (N, 4). parameters of every component in SI units:
+    * column 0 (emf): battery voltage, initial capacitor voltage
+    * column 1 (res): resistance of resistors and light bulbs
+    * column 2 (value): capacitance (F), inductance (H)
+    * column 3 (aux): light bulb wattage, Junction connections, switch state
+      (1 ON, 0 OFF), meter type (index into Meter_Type), initial inductor
+      current
+    unused columns are 0
+* edges.npy: int32 (E, 2). start and end of every Wire
+* meta.json: {"format": FORMAT_VERSION, "dt": float or null, "n": int or null}
+
+The legacy format, a pickled object array [comps, wires] or
+[comps, wires, dt, n] saved with np.save, can still be loaded and converted.
+"""
+import json
+import os
+import numpy as np
+from components import *
+from state import KINDS, JUNCTION, SWITCH, METER, BATTERY, RESISTOR, BULB, \
+    CAPACITOR, INDUCTOR, kind_of
+
+FORMAT_VERSION = 1
+EXTENSION = ".circuit"
+METER_TYPES = list(Meter_Type)
+
+
+def components_to_arrays(V, E):
+    """
+    params:
+        V: list or array of Components
+        E: list or array of Wires
+    return:
+        kind, params, edges: the arrays of the file format
+    """
+    kind = np.array([kind_of(c) for c in V], dtype=np.int8)
+    params = np.zeros((len(V), 4))
+    for i in range(len(V)):
+        c, k = V[i], kind[i]
+        params[i, 0] = c.emf if k in [BATTERY, CAPACITOR] else 0.
+        params[i, 1] = c.res if k in [RESISTOR, BULB] else 0.
+        if k == CAPACITOR:
+            params[i, 2] = c.cpty
+        elif k == INDUCTOR:
+            params[i, 2] = c.L
+        if k == BULB:
+            params[i, 3] = c.wattage
+        elif k == JUNCTION:
+            params[i, 3] = c.max_cxns_len
+        elif k == SWITCH:
+            params[i, 3] = float(c.state.value)
+        elif k == METER:
+            params[i, 3] = METER_TYPES.index(c.meter_type)
+        elif k == INDUCTOR:
+            params[i, 3] = c.curr
+    edges = np.array([w.pair for w in E], dtype=np.int32).reshape(-1, 2)
+    return kind, params, edges
+
+
+def arrays_to_components(kind, params, edges):
+    """
+    Inverse of components_to_arrays
+    return:
+        V: list of Components
+        E: list of Wires
+    """
+    V = []
+    for k, (emf, res, value, aux) in zip(kind, params):
+        if k == JUNCTION:
+            V.append(Junction(int(aux)))
+        elif k == SWITCH:
+            V.append(Switch(State(bool(aux))))
+        elif k == METER:
+            V.append(Multimeter(METER_TYPES[int(aux)]))
+        elif k == BATTERY:
+            V.append(DC_Battery(emf))
+        elif k == RESISTOR:
+            V.append(Resistor(res))
+        elif k == BULB:
+            V.append(Light_Bulb(res, aux))
+        elif k == CAPACITOR:
+            # the constructor takes microfarads. set the exact value afterwards
+            V.append(Capacitor(value * 1e+06, v_init=emf))
+            V[-1].cpty = value
+        elif k == INDUCTOR:
+            # the constructor takes microhenries
+            V.append(Inductor(value * 1e+06, i_init=aux))
+            V[-1].L = value
+        else:
+            V.append(KINDS[k]())
+    E = [Wire(int(start), int(end)) for start, end in edges]
+    return V, E
+
+
+def save_circuit(name, V, E, dt=None, n=None):
+    """
+    Saves a circuit in the format described at the top of this file
+    params:
+        name: str. path without the extension
+        V: list or array of Components
+        E: list or array of Wires
+        dt, n: optional. time step and number of steps
+    return:
+        str. the path of the saved circuit
+    """
+    path = name if name.endswith(EXTENSION) else name + EXTENSION
+    os.makedirs(path, exist_ok=True)
+    kind, params, edges = components_to_arrays(V, E)
+    np.save(os.path.join(path, "kind.npy"), kind)
+    np.save(os.path.join(path, "params.npy"), params)
+    np.save(os.path.join(path, "edges.npy"), edges)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"format": FORMAT_VERSION, "dt": dt, \
+                   "n": None if n is None else int(n)}, f)
+    return path
+
+
+def load_arrays(path, mmap_mode=None):
+    """
+    Loads the raw arrays of a circuit without creating any Components
+    params:
+        path: str. the .circuit directory
+        mmap_mode: optional. passed to np.load, e.g. "r" for large netlists
+    return:
+        kind, params, edges: arrays
+        meta: dict
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_VERSION:
+        raise ValueError("Unsupported circuit file format", meta.get("format"))
+    arrays = [np.load(os.path.join(path, f), mmap_mode=mmap_mode) \
+              for f in ["kind.npy", "params.npy", "edges.npy"]]
+    return arrays[0], arrays[1], arrays[2], meta
+
+
+def load_legacy(path):
+    """Loads a pickled object array saved by older versions of main.py"""
+    # the files are pickled object arrays: [comps, wires] or [comps, wires, dt, n]
+    data = np.load(path, allow_pickle=True)
+    V, E = list(data[0]), list(data[1])
+    if len(data) == 4:
+        return V, E, float(data[2]), int(data[3])
+    return V, E, None, None
+
+
+def find_circuit(name):
+    """
+    Finds the file of a circuit by name, preferring the new format
+    return:
+        str. the path, or None if there is no such circuit
+    """
+    for path in [name, name + EXTENSION, name + ".npy"]:
+        if os.path.isdir(path) or (os.path.isfile(path) and path.endswith(".npy")):
+            return path
+    return None
+
+
+def load_circuit(name, mmap_mode=None):
+    """
+    Loads a circuit saved by main.py or create_samples
+    params:
+        name: str. path of the circuit, with or without the extension. legacy
+            .npy files are recognised as well
+        mmap_mode: optional. see load_arrays
+    return:
+        V, E, dt, n: the arguments of Circuit. dt and n are None when the file
+            doesn't contain them
+    """
+    path = find_circuit(name)
+    if path is None:
+        raise FileNotFoundError("No such circuit", name)
+    if path.endswith(".npy"):
+        return load_legacy(path)
+    kind, params, edges, meta = load_arrays(path, mmap_mode)
+    V, E = arrays_to_components(kind, params, edges)
+    return V, E, meta["dt"], meta["n"]
+
+
+def convert_legacy(src, dst=None):
+    """
+    Converts a legacy pickled .npy circuit to the new format
+    params:
+        src: str. the legacy .npy file
+        dst: optional. name of the new circuit. defaults to src's name
+    return:
+        str. the path of the converted circuit
+    """
+    if dst is None:
+        dst = src[:-len(".npy")] if src.endswith(".npy") else src
+    V, E, dt, n = load_legacy(src)
+    return save_circuit(dst, V, E, dt, n)
+
+
+if __name__ == "__main__":
+    import sys
+    # python circuit_file.py legacy.npy [...]: converts legacy files
+    for src in sys.argv[1:]:
+        print(src, "->", convert_legacy(src))
@@ -2,11 +2,53 @@ import numpy as np
 from enum import Enum
 
 
+class StateField:
+    """
+    A value of a Component (emf, curr, res, ...). Once the component is part of
+    a compiled Circuit, the value lives in the arrays of the CircuitState and
+    the Component is just a view into them.
+    """
+    def __init__(self, refactor=False):
+        """
+        refactor: whether changing the value changes the matrix of the nodal
+            analysis, i.e. whether the Circuit has to refactor it
+        """
+        self.refactor = refactor
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, comp, owner=None):
+        if comp is None:
+            return self
+        if comp.circuit_state is None:
+            return comp.__dict__[self.name]
+        return getattr(comp.circuit_state, self.name)[comp.index]
+
+    def __set__(self, comp, value):
+        if comp.circuit_state is None:
+            comp.__dict__[self.name] = value
+        else:
+            getattr(comp.circuit_state, self.name)[comp.index] = value
+            if self.refactor:
+                comp.circuit_state.touch(comp.index)
+
+
 class Component:
     """
     The base class that holds the basic characteristics of the electric
     components.
     """
+    # set by Waveforms.attach: where the histories of the component are stored
+    waveforms = None
+    index = -1
+    # set by CircuitState.bind: the arrays that hold the component's values
+    circuit_state = None
+
+    emf = StateField()
+    curr = StateField()
+    res = StateField(refactor=True)
+
     def __init__(self, V_o, I_o, R_o, num_cxns=2):
         """
         emf: voltage drop across the component
@@ -19,17 +61,28 @@ class Component:
         self.res = R_o
         self.cxns = np.ones(num_cxns, dtype='int') * -1
 
-        # for graphing
-        self.v_hist = np.array([])
-        self.i_hist = np.array([])
+        # for graphing. v_hist and i_hist are stored by the Circuit
         self.r_hist = np.array([])
 
+    @property
+    def v_hist(self):
+        """Voltage history. A view into the Circuit's Waveforms"""
+        if self.waveforms is None:
+            return np.array([])
+        return self.waveforms.v[:self.waveforms.n, self.index]
+
+    @property
+    def i_hist(self):
+        """Current history. A view into the Circuit's Waveforms"""
+        if self.waveforms is None:
+            return np.array([])
+        return self.waveforms.i[:self.waveforms.n, self.index]
+
     def change_connection(self, old_c, new_c):
         """Replaces (the first occurrence of) old_c with new_c in self.cxns"""
-        for i in range(len(self.cxns)):
-            if self.cxns[i] == old_c:
-                self.cxns[i] = new_c
-                break
+        hits = np.flatnonzero(self.cxns == old_c)
+        if len(hits):
+            self.cxns[hits[0]] = new_c
         #for c in self.cxns:
         #    if c == old_c:
         #        c = new_c
@@ -56,6 +109,21 @@ class Component:
             elif w.end == name:
                 self.add_connection(w.start)
 
+    def detach(self):
+        """Copies the values out of the CircuitState and forgets the histories.
+        Used when the component is removed from its Circuit"""
+        if self.circuit_state is None:
+            return
+        values = {}
+        for cls in type(self).__mro__:
+            for name, attr in vars(cls).items():
+                if isinstance(attr, StateField) and name not in values:
+                    values[name] = getattr(self, name)
+        self.circuit_state = None
+        self.waveforms = None
+        self.index = -1
+        self.__dict__.update(values)
+
     @property
     def is_fully_connected(self):
         """Checks if all the component's ends have been connected"""
@@ -103,7 +171,7 @@ class Junction(Component):
     #override
     def rm_connection(self, c_rm):
         if len(self.cxns) > 2:
-            self.cxns = np.delete(self.cxns, -1)
+            self.cxns = np.delete(self.cxns, np.flatnonzero(self.cxns == c_rm)[:1])
         else:
             self.change_connection(c_rm, -1)
 
@@ -122,9 +190,33 @@ class State(Enum):
 class Switch(Component):
     """When OFF, current cannot flow through"""
     def __init__(self, state=State.ON): #probably not the best use of enums
-        super().__init__(self, 0, 0, 0)
+        super().__init__(0, 0, 0)
         self.state = state
 
+    @property
+    def state(self):
+        if self.circuit_state is None:
+            return self.__dict__["state"]
+        return State(bool(self.circuit_state.closed[self.index]))
+
+    @state.setter
+    def state(self, value):
+        if self.circuit_state is None:
+            self.__dict__["state"] = value
+        else:
+            self.circuit_state.closed[self.index] = value.value
+            self.circuit_state.touch(self.index)
+
+    #override
+    def detach(self):
+        state = self.state
+        super().detach()
+        self.__dict__["state"] = state
+
+    def toggle(self):
+        """Flips the switch. The Circuit refactors its matrix on the next step"""
+        self.state = State.OFF if self.state == State.ON else State.ON
+
 
 class Meter_Type(Enum):
     AMMETER = "A"
@@ -142,7 +234,13 @@ class Multimeter(Component):
         super().__init__(0, 0, R)
         self.meter_type = meter_type
         self.reading = -1.
-        self.reading_hist = np.array([])
+
+    @property
+    def reading_hist(self):
+        """History of the readings. A view into the Circuit's Waveforms"""
+        if self.waveforms is None:
+            return np.array([])
+        return self.waveforms.reading[:self.waveforms.n, self.index]
 
     def calc_reading(self, Circuit):
         """
@@ -158,8 +256,8 @@ class Multimeter(Component):
         elif self.meter_type == Meter_Type.OHMMETER:
             pass #TODO
 
-        print("Multimeter: {0:0.2f} {1}".format(self.reading, self.meter_type.value))
-        self.reading_hist = np.append(self.reading_hist, self.reading)
+        Circuit.message("Multimeter: {0:0.2f} {1}".format(self.reading, \
+                                                         self.meter_type.value))
         return self.reading
 
 
@@ -188,16 +286,20 @@ class Light_Bulb(Resistor):
         self.state = state
         self.wattage = W
 
-    def update_state(self):
+    def update_state(self, log=print):
+        """
+        log: optional. callable that receives the messages. None for silence
+        """
         if self.power == self.wattage:
             self.state = State.ON
             # This will change when a GUI is implemented
-            self.print_state()
+            self.print_state(log)
         else:
             self.state = State.OFF
 
-    def print_state(self):
-        print("The light bulb is on with {0:0.1f} Watts".format(self.wattage))
+    def print_state(self, log=print):
+        if log is not None:
+            log("The light bulb is on with {0:0.1f} Watts".format(self.wattage))
 
 
 class Capacitor(Component):
@@ -207,6 +309,9 @@ class Capacitor(Component):
     chg: charge of the capacitor
     kappa: the dielectric constant (1 in vacuum)
     """
+    # the implicit integrators' companion models depend on it
+    cpty = StateField(refactor=True)
+
     def __init__(self, C, v_init=0, kappa=1):
         # set a bound on the capacitor's initial voltage
         if v_init < 1e-02:
@@ -221,12 +326,15 @@ class Capacitor(Component):
 
 class Inductor(Component):
     """
-    Work in progress
+    Coil whose voltage drop is L di/dt
     L: inductance
     """
-    def __init__(self, L):
+    # the implicit integrators' companion models depend on it
+    L = StateField(refactor=True)
+
+    def __init__(self, L, i_init=0):
         # L given in microhenries
-        super().__init__(0, 0, 0) #TODO: has either v_init or i_init (maybe r_init?)
+        super().__init__(0, i_init, 0)
         self.L = L * 1e-06
 
 
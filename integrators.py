@@ -0,0 +1,377 @@
+import numpy as np
+from solvers import Factorization, refactor, load_scipy
+from reduction import ReducedSystem
+
+# "euler" is the explicit method of Circuit.run; the others are implemented here
+METHODS = ["euler", "backward_euler", "trapezoidal", "exact"]
+# order of accuracy of the implicit methods
+ORDER = {"backward_euler": 1, "trapezoidal": 2}
+# local truncation error = ERROR_CONST * h^(order+1) * divided difference
+ERROR_CONST = {"backward_euler": 1., "trapezoidal": 0.5}
+
+
+def propagator(A, B, h):
+    """
+    Exact solution of dy/dt = A y + B u over a time h with u held constant:
+    y(t + h) = Phi y(t) + Gamma u. Both come out of one matrix exponential of
+    [[A, B], [0, 0]] * h
+    params:
+        A: array of shape (n, n)
+        B: array of shape (n, p)
+        h: float, or array of shape (T,) for many times at once
+    return:
+        Phi: array of shape (n, n), or (T, n, n)
+        Gamma: array of shape (n, p), or (T, n, p)
+    """
+    scipy = load_scipy()
+    if scipy is None:
+        raise ImportError("The exact method requires scipy")
+    n = A.shape[0]
+    M = np.zeros((n + B.shape[1],) * 2)
+    M[:n, :n] = A
+    M[:n, n:] = B
+    E = scipy.linalg.expm(np.multiply.outer(np.asarray(h, dtype=float), M))
+    return E[..., :n, :n], E[..., :n, n:]
+
+
+def divided_difference(t, v):
+    """
+    Highest order divided difference v[t0, ..., tk] of the points (t[j], v[j]).
+    Approximates the k-th derivative divided by k!
+    params:
+        t: list of k+1 distinct times
+        v: list of k+1 arrays
+    return:
+        array
+    """
+    dd = list(v)
+    for level in range(1, len(t)):
+        dd = [(dd[j+1] - dd[j]) / (t[j+level] - t[j]) for j in range(len(dd) - 1)]
+    return dd[0]
+
+
+class Integrator:
+    """
+    Implicit time integration of a built Circuit with companion models. Every
+    capacitor becomes a resistance of h/C (backward Euler) or h/2C
+    (trapezoidal) and every inductor one of L/h or 2L/h, in series with a
+    source that holds its history, so the step matrix only depends on the step
+    size h and its factorization is reused for every step of that size.
+
+    With adaptive=True the step size follows an estimate of the local truncation
+    error (divided differences over the last accepted steps, or step doubling
+    until there are enough of them): steps are halved when the error exceeds
+    the tolerance and doubled once the circuit settles.
+    Step sizes stay powers of two of the initial step, so only a handful of
+    factorizations are ever made.
+    """
+    def __init__(self, circ, method="trapezoidal", adaptive=False, rtol=1e-3, \
+                 atol=1e-6, t_end=None, h_max=None):
+        """
+        params:
+            circ: class Circuit object. must be built
+            method: str. "backward_euler" or "trapezoidal"
+            adaptive: optional. whether to control the step size
+            rtol, atol: optional. relative and absolute tolerance of the
+                capacitor voltages and inductor currents per step
+            t_end: optional. time to stop at. defaults to dt * n of the circuit
+            h_max: optional. largest step size. defaults to t_end / 10
+        """
+        if method not in ORDER:
+            raise ValueError("Unknown integration method", method)
+        self.circ = circ
+        self.method = method
+        self.order = ORDER[method]
+        self.adaptive = adaptive
+        self.rtol = rtol
+        self.atol = atol
+
+        self.t = 0.
+        self.h = circ.t_step
+        self.t_end = t_end if t_end is not None else circ.t_step * circ.num_steps
+        self.h_max = h_max if h_max is not None else max(self.t_end / 10., self.h)
+        self.h_min = self.h * 2. ** -20
+
+        # factorizations of the step matrix by step size
+        self.factors = {}
+        self.factor_key = None
+        # the last full factorization of every step size and the state version
+        # it was made at. see Circuit.factorize
+        self.bases = {}
+        # the last accepted (time, state variables), oldest first. see
+        # CircuitState.variables
+        self.history = []
+        # statistics
+        self.solves = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        # the Circuit compiles a new state when components are added or removed
+        return self.circ.state
+
+    @property
+    def finished(self):
+        return self.t_end - self.t <= 1e-12 * max(self.t_end, 1.)
+
+    def companion(self, h):
+        """The diagonal entries of the capacitor and inductor rows for a step
+        of size h"""
+        st = self.state
+        c, l = st.capacitors, st.inductors
+        diag = np.zeros(st.size)
+        diag[c] = -h / st.cpty[c]
+        diag[l] = st.L[l] / h
+        if self.method == "trapezoidal":
+            diag[c] /= 2.
+            diag[l] *= 2.
+        return diag
+
+    def factor(self, h):
+        """The (cached) factorization of the step matrix for step size h"""
+        st = self.state
+        key = (st, st.version)
+        if key != self.factor_key:
+            # something the matrix depends on has changed
+            if self.factor_key is None or self.factor_key[0] is not st:
+                self.bases = {} # the topology has changed
+            self.factors = {}
+            self.factor_key = key
+        if h not in self.factors and self.circ.reduce:
+            with self.circ.phase("factorize"):
+                self.factors[h] = ReducedSystem(st, self.companion(h), \
+                                                backend=self.circ.solver)
+        elif h not in self.factors:
+            with self.circ.phase("assembly"):
+                rows, cols, vals = st.matrix(companion=self.companion(h))
+            base, version = self.bases.get(h, (None, st.version))
+            with self.circ.phase("factorize"):
+                factor = refactor(base, rows, cols, vals, \
+                                  st.changed_rows(version), st.size - 1, \
+                                  self.circ.solver)
+            if isinstance(factor, Factorization) and factor is not base:
+                self.bases[h] = (factor, st.version)
+            self.factors[h] = factor
+        return self.factors[h]
+
+    def start(self):
+        """
+        Finds the currents at t = 0, when the capacitors hold their initial
+        voltages, and records them as the first step
+        return:
+            float. the time, 0
+        """
+        st = self.state
+        factor = self.circ.factorize()
+        with self.circ.phase("solve"):
+            x = factor.solve(st.rhs())
+        with self.circ.phase("write_back"):
+            st.scatter(x)
+            st.settle()
+        self.restart()
+        self.circ.finish_step()
+        return self.t
+
+    def restart(self):
+        """Starts the step history over from the current state, e.g. after the
+        topology has changed. Adaptive steps estimate their error by step
+        doubling until enough steps have been taken again"""
+        st = self.state
+        self.history = [(self.t, st.variables())]
+
+    def trial(self, h):
+        """
+        Solves a step of size h from the current state without committing it
+        return:
+            x: the solution of the nodal analysis at t + h
+            y: array. the state variables at t + h. see
+                CircuitState.variables
+        """
+        st = self.state
+        c, l = st.capacitors, st.inductors
+        u, w = st.unknown[c], st.unknown[l]
+        factor = self.factor(h)
+        with self.circ.phase("assembly"):
+            # rhs() puts the inductor currents in their rows. the companion
+            # source of an inductor is its resistance times that current
+            b = st.rhs()
+            b[w, 0] *= st.L[l] / h
+            if self.method == "trapezoidal":
+                b[w, 0] *= 2.
+                b[u, 0] += h / (2. * st.cpty[c]) * st.curr[c]
+                b[w, 0] += st.emf[l]
+        with self.circ.phase("solve"):
+            x = factor.solve(b)
+        self.solves += 1
+        if self.circ.profiler is not None:
+            self.circ.profiler.step(factor)
+
+        if self.method == "trapezoidal":
+            v = st.emf[c] + h / (2. * st.cpty[c]) * (st.curr[c] + x[u, 0])
+        else:
+            v = st.emf[c] + h / st.cpty[c] * x[u, 0]
+        return x, np.concatenate([v, x[w, 0]])
+
+    def error(self, h, y):
+        """
+        Estimated local truncation error of a step to t + h relative to the
+        tolerance. <= 1 means the step is accurate enough. None if there are
+        not enough steps in the history yet
+        """
+        k = self.order + 1
+        if len(self.history) < k:
+            return None
+        points = self.history[-k:] + [(self.t + h, y)]
+        dd = divided_difference([p[0] for p in points], [p[1] for p in points])
+        lte = ERROR_CONST[self.method] * h ** k * np.abs(dd)
+        scale = self.atol + self.rtol * np.abs(y)
+        return np.max(lte / scale) if len(y) > 0 else 0.
+
+    def doubling_error(self, h, y):
+        """
+        Like error(), by step doubling: the step to t + h is compared with two
+        steps of h / 2, which differ from it by about (2^p - 1) / 2^p of its
+        error for a method of order p. Used while the history is too short
+        """
+        st = self.state
+        emf, curr = st.emf, st.curr
+        x, half = self.trial(h / 2.)
+        try:
+            # the first half step is taken on copies of the state
+            st.emf, st.curr = emf.copy(), curr.copy()
+            st.scatter(x)
+            st.emf[st.capacitors] = half[:len(st.capacitors)]
+            st.settle()
+            _, y2 = self.trial(h / 2.)
+        finally:
+            st.emf, st.curr = emf, curr
+        p = 2. ** self.order
+        lte = p / (p - 1.) * np.abs(y - y2)
+        scale = self.atol + self.rtol * np.abs(y)
+        return np.max(lte / scale) if len(y) > 0 else 0.
+
+    def step(self):
+        """
+        Takes one accepted step and records it
+        return:
+            float. the time reached
+        """
+        while True:
+            h = min(self.h, self.t_end - self.t)
+            x, y = self.trial(h)
+            err = self.error(h, y) if self.adaptive else 0.
+            if err is None:
+                err = self.doubling_error(h, y)
+            if err <= 1. or self.h <= self.h_min:
+                break
+            self.rejected += 1
+            self.h = max(self.h / 2., self.h_min)
+
+        st = self.state
+        with self.circ.phase("write_back"):
+            st.scatter(x)
+            st.emf[st.capacitors] = y[:len(st.capacitors)]
+            st.settle()
+
+        self.t += h
+        self.history = self.history[-self.order-1:] + [(self.t, y)]
+        if self.adaptive and err * 2. ** (self.order + 1) < 0.5:
+            # a step twice as long would still be well within the tolerance
+            self.h = min(2. * self.h, self.h_max)
+
+        self.circ.finish_step()
+        return self.t
+
+
+class ExactIntegrator:
+    """
+    Exact time integration of a built Circuit. Every component is linear, so
+    the circuit is the linear time-invariant system of Circuit.state_space and
+    a step of size h is y -> Phi y + Gamma u with the matrix exponentials of
+    propagator(). They are computed once per step size, so steps carry no
+    truncation error, however long the run. The batteries are read every step
+    and the rest of the circuit follows from the state variables with the
+    factorization of Circuit.run.
+    """
+    def __init__(self, circ, t_end=None):
+        """
+        params:
+            circ: class Circuit object. must be built
+            t_end: optional. time to stop at. defaults to dt * n of the circuit
+        """
+        self.circ = circ
+        self.t = 0.
+        self.h = circ.t_step
+        self.t_end = t_end if t_end is not None else circ.t_step * circ.num_steps
+        # propagators by step size and the state version they were made at
+        self.propagators = {}
+        self.key = None
+        self.solves = 0
+
+    @property
+    def state(self):
+        return self.circ.state
+
+    @property
+    def finished(self):
+        return self.t_end - self.t <= 1e-12 * max(self.t_end, 1.)
+
+    def propagator(self, h):
+        """The (cached) Phi and Gamma of a step of size h"""
+        st = self.state
+        key = (st, st.version)
+        if key != self.key:
+            self.propagators = {}
+            self.key = key
+        if h not in self.propagators:
+            with self.circ.phase("factorize"):
+                A, B, _, _ = self.circ.state_space()
+                self.propagators[h] = propagator(A, B, h)
+        return self.propagators[h]
+
+    def settle(self):
+        """Solves the rest of the circuit for the current state variables"""
+        st = self.state
+        factor = self.circ.factorize()
+        with self.circ.phase("solve"):
+            x = factor.solve(st.rhs())
+        self.solves += 1
+        if self.circ.profiler is not None:
+            self.circ.profiler.step(factor)
+        with self.circ.phase("write_back"):
+            st.scatter(x)
+            st.settle()
+
+    def start(self):
+        """
+        Records the initial state as the first step
+        return:
+            float. the time, 0
+        """
+        self.settle()
+        self.circ.finish_step()
+        return self.t
+
+    def restart(self):
+        """Nothing to do: the propagators are recomputed when the circuit
+        changes. see Circuit.recompile"""
+        pass
+
+    def step(self):
+        """
+        Takes one exact step and records it
+        return:
+            float. the time reached
+        """
+        h = min(self.h, self.t_end - self.t)
+        Phi, Gamma = self.propagator(h)
+        st = self.state
+        y = Phi @ st.variables() + Gamma @ st.emf[st.batteries]
+        c = len(st.capacitors)
+        st.emf[st.capacitors] = y[:c]
+        st.curr[st.inductors] = y[c:]
+        self.settle()
+
+        self.t += h
+        self.circ.finish_step()
+        return self.t
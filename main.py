@@ -1,8 +1,9 @@
 from components import *
 from circuit import Circuit
-from sample_circuits import create_samples
+from circuit_file import load_circuit, save_circuit
+from cache import ResultCache
+import copy
 import sys
-import numpy as np
 
 
 def valid_file_name(s):
@@ -21,6 +22,11 @@ def valid_file_name(s):
     return True
 
 
+# the results of earlier runs, so that running the same circuit again doesn't
+# simulate it again
+results = ResultCache(path=".circuit_cache")
+
+
 num_comps = 0
 while not (1 <= num_comps < 21):
     print("Enter 1 to load Circuit from file")
@@ -33,8 +39,14 @@ if num_comps == 1:
     while not valid_file_name(file_name):
         file_name = input("Enter file name.\n>> ").strip()
 
+    # only needed here, so it is not imported for manually entered circuits
+    from sample_circuits import create_samples
     create_samples(file_name)
-    circ = Circuit(*np.load(file_name + ".npy"))
+    V, E, dt, n = load_circuit(file_name)
+    if dt is None:
+        circ = Circuit(V, E, cache=results)
+    else:
+        circ = Circuit(V, E, dt, n, cache=results)
 
     print('done')
     sys.exit()
@@ -47,7 +59,8 @@ wires = []
 dt = 0
 n = 1
 # All the components available to the user
-comp_names = ["BATTERY", "JUNCTION", "RESISTOR", "BULB", "CAPACITOR", "MULTI_METER"]
+comp_names = ["BATTERY", "JUNCTION", "RESISTOR", "BULB", "CAPACITOR", \
+              "INDUCTOR", "MULTI_METER"]
 # A nice way to keep track of the data to be collected and to reinforce bounds
 comp_data = {
     "BATTERY": {
@@ -74,6 +87,12 @@ comp_data = {
         "msg": ["capacitance (microfarads).", "initial voltage."],
         "comp": Capacitor
     },
+    "INDUCTOR": {
+        "lower_bound": [1e-03, 0.],
+        "upper_bound": [1e+06, 100.],
+        "msg": ["inductance (microhenries).", "initial current."],
+        "comp": Inductor
+    },
     "BULB": {
         "lower_bound": [1e-03, 1.],
         "upper_bound": [1000., 100.],
@@ -178,14 +197,27 @@ while not is_complete():
 
 
 for c in comps:
-    if isinstance(c, Capacitor):
-        caution_msg = """\nPlease be advised that the values you are about to
-enter have significant influence over how the graphs will look. We
-recommend that the time increment be small and the number of steps be
-such that time increment * number of steps ~ 4 * R_equiv * C_equiv"""
-        print(caution_msg)
-        dt = float(input("Please enter the time increment.\n>> ").strip())
-        n = int(input("Please enter the number of steps.\n>> ").strip())
+    if isinstance(c, (Capacitor, Inductor)):
+        # suggest a time increment and number of steps from the time constants
+        # of the circuit. built on a copy since building changes the circuit
+        trial = Circuit(*copy.deepcopy((comps, wires)), simulate=False, \
+                        log=None, plot=False)
+        suggested = trial.build()
+        if suggested:
+            dt, n = trial.suggest_timing()
+            print("\nSuggested time increment: {0:0.3g} s, number of steps: "
+                  "{1}. Leave blank to use them.".format(dt, n))
+
+        inp = input("Please enter the time increment.\n>> ").strip()
+        while not (inp or suggested):
+            inp = input("Please enter the time increment.\n>> ").strip()
+        if inp:
+            dt = float(inp)
+        inp = input("Please enter the number of steps.\n>> ").strip()
+        while not (inp or suggested):
+            inp = input("Please enter the number of steps.\n>> ").strip()
+        if inp:
+            n = int(inp)
         break
 
 
@@ -193,9 +225,9 @@ if input("Would you like to save the circuit?\n>> ").strip() == "y":
     c_name = ""
     while not valid_file_name(c_name):
         c_name = input("Enter file name without extension\n>> ").strip()
-    np.save(c_name, np.array([comps, wires, dt, n]))
+    save_circuit(c_name, comps, wires, dt, n)
 
 # Creates the actual circuit and starts all the calculations
-circ = Circuit(comps, wires, dt, n)
+circ = Circuit(comps, wires, dt, n, cache=results)
 
 print('done')
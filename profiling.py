@@ -0,0 +1,95 @@
+"""
+Opt-in timing of the phases of a Circuit, for runs that want to know where the
+time goes without running cProfile. Pass a Profiler to Circuit:
+
+    profiler = Profiler()
+    circ = Circuit(V, E, dt, n, profiler=profiler)
+    print(profiler.summary())
+
+The phases are:
+* validate, add_nulls, add_junctions, compile: building the circuit
+* assembly: the matrix and right-hand side of the nodal analysis
+* factorize, solve: the linear algebra
+* write_back: putting the solutions into the components
+* calc_reading: Multimeter.calc_reading
+* record: storing the histories
+* plot: graphing the results
+"""
+import time
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Collects the time and number of calls of every phase and the size and
+    number of nonzeros of the matrix solved at every step
+    """
+    def __init__(self, on_phase=None, on_step=None):
+        """
+        params:
+            on_phase: optional. callable(name, seconds) called after every
+                timed phase
+            on_step: optional. callable(step, size, nnz) called for every
+                solved step
+        """
+        self.on_phase = on_phase
+        self.on_step = on_step
+        self.times = {}
+        self.calls = {}
+        # per step
+        self.sizes = []
+        self.nnz = []
+
+    @contextmanager
+    def phase(self, name):
+        """Times the block as the given phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.times[name] = self.times.get(name, 0.) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.on_phase is not None:
+                self.on_phase(name, elapsed)
+
+    def step(self, factor):
+        """
+        Records the matrix of a step
+        params:
+            factor: the Factorization, LowRankUpdate or ReducedSystem used
+        """
+        size = getattr(factor, "reduced_size", factor.size)
+        self.sizes.append(size)
+        self.nnz.append(factor.nnz)
+        if self.on_step is not None:
+            self.on_step(len(self.sizes) - 1, size, factor.nnz)
+
+    def reset(self):
+        """Forgets everything that was recorded"""
+        self.times, self.calls = {}, {}
+        self.sizes, self.nnz = [], []
+
+    def report(self):
+        """
+        return:
+            dict. {"phases": {name: {"time": seconds, "calls": int}},
+                   "steps": {"size": list, "nnz": list}}
+        """
+        phases = {}
+        for name in self.times:
+            phases[name] = {"time": self.times[name], "calls": self.calls[name]}
+        return {"phases": phases, \
+                "steps": {"size": list(self.sizes), "nnz": list(self.nnz)}}
+
+    def summary(self):
+        """A table of the phases, slowest first"""
+        lines = ["{0:<14}{1:>12}{2:>10}".format("phase", "time (s)", "calls")]
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("{0:<14}{1:>12.4f}{2:>10}".format(name, self.times[name], \
+                                                           self.calls[name]))
+        if self.sizes:
+            lines.append("{0} steps, matrix size {1}-{2}, nonzeros {3}-{4}".format( \
+                len(self.sizes), min(self.sizes), max(self.sizes), min(self.nnz), \
+                max(self.nnz)))
+        return "\n".join(lines)
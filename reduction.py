@@ -0,0 +1,318 @@
+"""
+Node reduction of the nodal analysis.
+
+build() puts a Junction into every wire and a Null_Component between any two
+Junctions, so the full system (see state.CircuitState.matrix) has an unknown
+for every component. ReducedSystem solves a much smaller one instead:
+* Junctions connected by shorts (Null_Components, closed switches, zero
+  resistances) are merged into one node
+* nodes between exactly two resistances are eliminated: the two become one
+  series resistance. Nodes at a multimeter (the probes of a circuit), a source,
+  an inductor or the ground are kept
+* parallel resistances need no extra work: their conductances simply add up
+* inductors are known currents under forward Euler, so they only appear on the
+  right-hand side. with a companion model they are sources like capacitors
+The unknowns are the voltages of the remaining nodes and the currents of the
+sources. Everything else is worked out afterwards, so the result is the same as
+solving the full system.
+"""
+import numpy as np
+from solvers import Factorization
+from state import SOURCES, RESISTIVE, INDUCTOR
+
+
+class ReducedSystem:
+    """
+    Drop-in replacement for a Factorization of the full system: solve() takes
+    and returns vectors laid out like the full system's. The right-hand side
+    may only be nonzero in the rows of the sources and inductors, which is all
+    the nodal analysis ever needs.
+    Depends on the resistances and the switches, so it is rebuilt whenever the
+    Circuit would refactor its matrix.
+    """
+    def __init__(self, state, companion=None, closed=None, backend="auto"):
+        """
+        params:
+            state: class CircuitState object
+            companion: optional. see CircuitState.matrix. only the entries of
+                the sources and inductors are used
+            closed: optional. see CircuitState.matrix
+            backend: str. solver backend of the reduced system. see solvers.py
+        """
+        st = state
+        self.state = st
+        if closed is None:
+            closed = st.closed
+        self.size = st.size - 1
+
+        comps = st.branches
+        is_source = np.isin(st.kind[comps], SOURCES) & closed[comps]
+        is_resistive = np.isin(st.kind[comps], RESISTIVE) & closed[comps] & \
+                       (st.res[comps] > 0)
+        is_inductor = st.kind[comps] == INDUCTOR
+        is_short = closed[comps] & ~is_source & ~is_resistive & ~is_inductor
+        self.sources = comps[is_source]
+        self.resistive = comps[is_resistive]
+        self.shorts = comps[is_short]
+        # the rows of the full system are multiplied by these to get the
+        # voltage rows of the sources. an inductor's row has the opposite sign
+        self.sign = np.ones(len(self.sources))
+        if companion is None:
+            self.inductors = comps[is_inductor]
+        else:
+            self.inductors = comps[:0]
+            self.sources = np.concatenate([self.sources, comps[is_inductor]])
+            self.sign = np.concatenate([self.sign, \
+                                        -np.ones(np.count_nonzero(is_inductor))])
+
+        self.merge_nodes(st)
+        self.eliminate_series(st)
+        self.build_matrix(st, companion, backend)
+        self.plan_shorts(st)
+
+    def merge_nodes(self, st):
+        """Merges the Junctions that are connected by shorts into nodes"""
+        parent = np.arange(st.size)
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+        for s in self.shorts:
+            a, b = find(st.cxn[s, 0]), find(st.cxn[s, 1])
+            if a != b:
+                parent[a] = b
+
+        # number the nodes 0, 1, ... in the order of their Junctions
+        roots = np.array([find(j) for j in st.junctions], dtype=int)
+        ids, node_of = np.unique(roots, return_inverse=True)
+        self.num_nodes = len(ids)
+        self.node = np.full(st.size, -1)
+        self.node[st.junctions] = node_of
+        self.ground = self.node[st.ground]
+
+    def eliminate_series(self, st):
+        """
+        Replaces every node between exactly two resistances with one series
+        resistance, repeatedly, so a chain of resistors becomes one. Records how
+        to get the voltages of the eliminated nodes back
+        """
+        ends = self.node[st.cxn[self.resistive]].reshape(-1, 2)
+        # the resistances between nodes: [start, end, resistance], alive or not
+        edges = [[a, b, r] for (a, b), r in zip(ends.tolist(), \
+                                                st.res[self.resistive].tolist())]
+        alive = [True] * len(edges)
+        at = [set() for _ in range(self.num_nodes)]
+        for e in range(len(edges)):
+            a, b = edges[e][0], edges[e][1]
+            if a != b:
+                at[a].add(e)
+                at[b].add(e)
+
+        # nodes that must stay: the ground and the ends of sources, inductors
+        # and meters
+        keep = np.zeros(self.num_nodes, dtype=bool)
+        keep[self.ground] = True
+        probes = np.concatenate([self.sources, self.inductors, st.meters])
+        keep[self.node[st.cxn[probes]].ravel()] = True
+        # resistances with both ends at the same node carry no current. keep
+        # their node, for simplicity
+        for a, b in ends.tolist():
+            if a == b:
+                keep[a] = True
+
+        # (node, a, b, conductance to a, conductance to b) in order
+        self.eliminated = []
+        queue = [m for m in range(self.num_nodes) if not keep[m] and len(at[m]) == 2]
+        while queue:
+            m = queue.pop()
+            if keep[m] or len(at[m]) != 2:
+                continue
+            e1, e2 = at[m]
+            a = edges[e1][0] if edges[e1][1] == m else edges[e1][1]
+            b = edges[e2][0] if edges[e2][1] == m else edges[e2][1]
+            r1, r2 = edges[e1][2], edges[e2][2]
+            for e in [e1, e2]:
+                alive[e] = False
+                at[edges[e][0]].discard(e)
+                at[edges[e][1]].discard(e)
+            keep[m] = True # never look at it again
+            self.eliminated.append((m, a, b, 1. / r1, 1. / r2))
+            if a != b:
+                edges.append([a, b, r1 + r2])
+                alive.append(True)
+                at[a].add(len(edges) - 1)
+                at[b].add(len(edges) - 1)
+            for n in [a, b]:
+                if len(at[n]) == 2:
+                    queue.append(n)
+
+        self.edges = np.array([edges[e] for e in range(len(edges)) \
+                               if alive[e] and edges[e][0] != edges[e][1]], \
+                              dtype=float).reshape(-1, 3)
+
+        # the eliminated voltages as weighted sums of two remaining nodes:
+        # U[m] = w_a U[a] + w_b U[b], working backwards
+        gone = np.zeros(self.num_nodes, dtype=bool)
+        for m, _, _, _, _ in self.eliminated:
+            gone[m] = True
+        self.kept = np.flatnonzero(~gone)
+        expr = {}
+        for m, a, b, g1, g2 in reversed(self.eliminated):
+            total = {}
+            for n, w in [(a, g1 / (g1 + g2)), (b, g2 / (g1 + g2))]:
+                for k, v in (expr[n] if n in expr else {n: 1.}).items():
+                    total[k] = total.get(k, 0.) + w * v
+            expr[m] = total
+        self.elim = np.array(list(expr.keys()), dtype=int)
+        terms = [list(expr[m].items()) + [(self.ground, 0.)] * (2 - len(expr[m])) \
+                 for m in self.elim]
+        self.elim_nodes = np.array([[t[0][0], t[1][0]] for t in terms], \
+                                   dtype=int).reshape(-1, 2)
+        self.elim_weights = np.array([[t[0][1], t[1][1]] for t in terms], \
+                                     dtype=float).reshape(-1, 2)
+
+    def build_matrix(self, st, companion, backend):
+        """Assembles and factors the reduced system"""
+        # unknowns: the voltages of the kept nodes except for the ground, then
+        # the currents of the sources
+        free = self.kept[self.kept != self.ground]
+        self.col = np.full(self.num_nodes, -1)
+        self.col[free] = np.arange(len(free))
+        self.num_free = len(free)
+        self.reduced_size = len(free) + len(self.sources)
+        src_col = self.num_free + np.arange(len(self.sources))
+
+        rows, cols, vals = [], [], []
+        def add(r, c, v):
+            keep = (r >= 0) & (c >= 0)
+            rows.append(r[keep])
+            cols.append(c[keep])
+            vals.append(np.broadcast_to(v, r.shape)[keep])
+
+        # Kirchhoff's current law of the nodes. the current of a resistance
+        # flows into its first node: G (U[b] - U[a])
+        a = self.col[self.edges[:, 0].astype(int)]
+        b = self.col[self.edges[:, 1].astype(int)]
+        g = 1. / self.edges[:, 2]
+        add(a, a, -g)
+        add(a, b, g)
+        add(b, b, -g)
+        add(b, a, g)
+        # the currents of the sources, like in the full system
+        s0 = self.col[self.node[st.cxn[self.sources, 0]]]
+        s1 = self.col[self.node[st.cxn[self.sources, 1]]]
+        add(s0, src_col, 1.)
+        add(s1, src_col, -1.)
+        # the voltages of the sources
+        add(src_col, s0, -1.)
+        add(src_col, s1, 1.)
+        if companion is not None:
+            add(src_col, src_col, self.sign * companion[self.sources])
+
+        self.factor = Factorization(np.concatenate(rows), np.concatenate(cols), \
+                                    np.concatenate(vals), self.reduced_size, \
+                                    backend)
+        self.backend = self.factor.backend
+        self.nnz = self.factor.nnz
+
+    def plan_shorts(self, st):
+        """
+        Prepares the currents of the shorts. Within a node the shorts form a
+        tree of Junctions (a loop of shorts carries no current), so the current
+        of a short is whatever flows into the Junctions on one side of it
+        (Kirchhoff's current law). The Junctions are put in depth-first order,
+        so every side is a contiguous range and its inflow a difference of
+        cumulative sums
+        """
+        adj = {}
+        for s in self.shorts:
+            a, b = st.cxn[s]
+            if a != b:
+                adj.setdefault(a, []).append((b, s))
+                adj.setdefault(b, []).append((a, s))
+
+        order, tin, tout = [], {}, {}
+        # (short, Junction on the far side of it from the root)
+        tree = []
+        for root in st.junctions:
+            if root in tin:
+                continue
+            tin[root] = len(order)
+            order.append(root)
+            stack = [(root, iter(adj.get(root, [])))]
+            while stack:
+                j, neighbours = stack[-1]
+                for k, s in neighbours:
+                    if k not in tin:
+                        tin[k] = len(order)
+                        order.append(k)
+                        tree.append((s, k))
+                        stack.append((k, iter(adj.get(k, []))))
+                        break
+                else:
+                    stack.pop()
+                    tout[j] = len(order)
+
+        self.order = np.array(order, dtype=int)
+        self.tree_shorts = np.array([s for s, _ in tree], dtype=int)
+        child = np.array([k for _, k in tree], dtype=int)
+        self.side_start = np.array([tin[k] for k in child], dtype=int)
+        self.side_end = np.array([tout[k] for k in child], dtype=int)
+        # the short's current enters its first terminal: -inflow of the side
+        # if that's the side's Junction, +inflow otherwise
+        self.side_sign = np.where(st.cxn[self.tree_shorts, 0] == child, -1., 1.)
+
+    def solve(self, b):
+        """
+        Solves the full system Ax = b through the reduced one
+        params:
+            b: array of shape (size,) or (size, k). see the class docstring
+        return:
+            array with the same shape as b
+        """
+        st = self.state
+        u = st.unknown
+        x_shape = b.shape
+        b = b.reshape(self.size, -1)
+        k = b.shape[1]
+
+        rb = np.zeros((self.reduced_size, k))
+        rb[self.num_free:] = self.sign[:, None] * b[u[self.sources]]
+        # the known currents of the inductors flow into their nodes
+        known = b[u[self.inductors]]
+        for t, sign in [(0, -1.), (1, 1.)]:
+            c = self.col[self.node[st.cxn[self.inductors, t]]]
+            np.add.at(rb, c[c >= 0], sign * known[c >= 0])
+        y = self.factor.solve(rb)
+
+        # node voltages
+        U = np.zeros((self.num_nodes, k))
+        free = self.col >= 0
+        U[free] = y[self.col[free]]
+        if len(self.elim):
+            U[self.elim] = np.einsum("ij,ijk->ik", self.elim_weights, \
+                                     U[self.elim_nodes])
+
+        curr = np.zeros((st.size, k))
+        curr[self.sources] = y[self.num_free:]
+        curr[self.inductors] = known
+        r = self.resistive
+        curr[r] = (U[self.node[st.cxn[r, 1]]] - U[self.node[st.cxn[r, 0]]]) / \
+                  st.res[r, None]
+
+        # what flows into every Junction from everything but the shorts
+        inflow = st.inflow(curr.T).T
+        cumulative = np.concatenate([np.zeros((1, k)), \
+                                     np.cumsum(inflow[self.order], axis=0)])
+        side = cumulative[self.side_end] - cumulative[self.side_start]
+        curr[self.tree_shorts] = self.side_sign[:, None] * side
+
+        x = np.zeros((st.size, k))
+        x[st.junctions] = U[self.node[st.junctions]]
+        x[st.branches] = curr[st.branches]
+        # into the order of the full system, without the ground
+        full = np.zeros((self.size, k))
+        keep = np.arange(st.size) != st.ground
+        full[u[keep]] = x[keep]
+        return full.reshape(x_shape)
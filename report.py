@@ -0,0 +1,53 @@
+"""
+Reporting of the results of a Circuit: printing and graphing. Kept out of
+circuit.py so that simulations that don't report anything never load it, and
+matplotlib is only imported once something is actually graphed.
+"""
+from components import *
+
+
+def print_circuit_data(circ, ignore=[Junction, Null_Component], w=False):
+    """
+    Prints specified data of the circuit to its log
+    params:
+        circ: class Circuit object
+        ignore: list of component types not to be printed
+        w: bool. whether the wires will be printed
+    """
+    circ.message("============")
+    circ.message("Circuit Data")
+    circ.message("============")
+    for i in range(circ.lenv):
+        c = circ.vertices[i]
+        if not type(c) in ignore:
+            circ.message("{0} {1} I: {2:0.6f} V: {3:0.3f} R: {4:0.1f}".format(i, \
+                         type(c), c.curr, c.emf, c.res))
+
+    circ.message("============")
+
+    if w:
+        for wire in circ.edges:
+            circ.message(wire.pair)
+
+
+def graph_circuit_data(circ, comps=[Capacitor], vir=0):
+    """
+    Graph data of certain components
+    params:
+        circ: class Circuit object
+        comps: list. types to graph
+        viq: int. Voltage (0), Current (1), Resistance (2)
+    """
+    #TODO: Charge for Capacitors
+    #TODO: make subplots
+    if not circ.contains(comps):
+        return 1 # nothing to graph
+    import matplotlib.pyplot as plt
+    for c in circ.vertices:
+        if type(c) in comps:
+            plt.plot(circ.t_hist, [c.v_hist, c.i_hist, c.r_hist][vir])
+
+    plt.xlabel("Time (s)")
+    plt.ylabel(["Voltage (V)", "Current (I)", r"Resistance ($\Omega$)"][vir])
+    plt.show()
+    return 0
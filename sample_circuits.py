@@ -1,12 +1,12 @@
-import numpy as np
 from components import *
+from circuit_file import save_circuit
 
 
 def create_samples(data_key):
 
     data = {
         # a very simple circuit
-        "c1": np.array([
+        "c1": ([
             [
                 DC_Battery(12),
                 Resistor(5)
@@ -17,7 +17,7 @@ def create_samples(data_key):
             ]
         ]),
         # a more complex circuit
-        "c2": np.array([
+        "c2": ([
             [
                 DC_Battery(100),
                 Junction(),
@@ -42,7 +42,7 @@ def create_samples(data_key):
             ]
         ]),
         # basic RC circuit
-        "c3": np.array([
+        "c3": ([
             [
                 Capacitor(100, v_init=12),
                 Resistor(1000)
@@ -53,7 +53,7 @@ def create_samples(data_key):
             ]
         ]),
         # charging a capacitor
-        "c4": np.array([
+        "c4": ([
             [
                 Capacitor(100),
                 Resistor(1000),
@@ -68,7 +68,7 @@ def create_samples(data_key):
 
         # Circuit failures
         # two disjoint circuit
-#        "c5": np.array([
+#        "c5": ([
 #            [
 #                DC_Battery(12),
 #                Resistor(5),
@@ -84,7 +84,7 @@ def create_samples(data_key):
 #        ]),
         # invalid loop within a circuit
         # surprisingly, the computations come out correct
-        "c6": np.array([
+        "c6": ([
             [
                 DC_Battery(12),
                 Resistor(5),
@@ -106,7 +106,7 @@ def create_samples(data_key):
 
         #Other tests
         # two batteries with opposing ends
-        "c7": np.array([
+        "c7": ([
             [
                 DC_Battery(12),
                 DC_Battery(9),
@@ -120,7 +120,7 @@ def create_samples(data_key):
         ]),
 
         # time constant/numerical integration failures
-        "c8": np.array([
+        "c8": ([
             [
                 DC_Battery(100),
                 Resistor(500),
@@ -132,7 +132,7 @@ def create_samples(data_key):
                 Wire(2, 0)
             ]
         ]),
-        "c9": np.array([
+        "c9": ([
             [
                 DC_Battery(100),
                 Resistor(5),
@@ -146,7 +146,7 @@ def create_samples(data_key):
         ]),
 
         # two capacitors
-        "c10": np.array([
+        "c10": ([
             [
                 Capacitor(100, v_init=3),
                 Capacitor(200, v_init=12),
@@ -160,7 +160,7 @@ def create_samples(data_key):
         ]),
 
         # Voltmeter
-        "c11": np.array([
+        "c11": ([
             [
                 DC_Battery(12),
                 Multimeter(),
@@ -179,7 +179,7 @@ def create_samples(data_key):
         ]),
 
         # Ammeter
-        "c12": np.array([
+        "c12": ([
             [
                 DC_Battery(12),
                 Multimeter(Meter_Type.AMMETER),
@@ -193,7 +193,7 @@ def create_samples(data_key):
         ]),
 
         # wheatstone bridge
-        "c13": np.array([
+        "c13": ([
             [
                 DC_Battery(100),
                 Junction(),
@@ -222,7 +222,7 @@ def create_samples(data_key):
             ]
         ]),
 
-        "c14": np.array([
+        "c14": ([
             [
                 DC_Battery(1),
                 Junction(4),
@@ -278,7 +278,7 @@ def create_samples(data_key):
             ]
         ]),
 
-        "c15": np.array([
+        "c15": ([
             [
                 DC_Battery(7.8),
                 Resistor(1001),
@@ -308,7 +308,7 @@ def create_samples(data_key):
             files.append(data[key])
         return files
     elif data_key in data.keys():
-        np.save(data_key, data[data_key])
+        save_circuit(data_key, *data[data_key])
         #could actually just return the array
         return 0
     else:
@@ -0,0 +1,200 @@
+import importlib.util
+import warnings
+from functools import lru_cache
+import numpy as np
+from numpy.linalg import inv, LinAlgError
+
+# Systems with more unknowns than this are solved with the sparse backend when
+# the backend is "auto". Below it the dense solver is faster
+SPARSE_THRESHOLD = 200
+
+BACKENDS = ["auto", "dense", "sparse"]
+
+# A matrix whose rows changed is factored from scratch once more than this many
+# rows differ from the last full factorization. see LowRankUpdate
+MAX_UPDATE_RANK = 8
+
+
+@lru_cache(maxsize=None)
+def has_sparse():
+    """Checks if the sparse backend (scipy) is available without importing it"""
+    return importlib.util.find_spec("scipy") is not None
+
+
+@lru_cache(maxsize=None)
+def load_scipy():
+    """
+    Imports scipy the first time a system is actually solved. scipy is optional
+    and slow to import, so nothing that doesn't solve anything pays for it.
+    return:
+        the scipy package, or None if it isn't installed
+    """
+    if not has_sparse():
+        return None
+    import scipy.linalg
+    import scipy.sparse
+    import scipy.sparse.linalg
+    return scipy
+
+
+def pick_backend(backend, size):
+    """
+    Resolves the backend that will be used for a system of a given size
+    params:
+        backend: str. one of BACKENDS
+        size: int. number of unknowns in the system
+    return:
+        str. "dense" or "sparse"
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Unknown solver backend", backend)
+    if backend == "sparse" and not has_sparse():
+        raise ImportError("The sparse backend requires scipy")
+    if backend == "auto":
+        if size > SPARSE_THRESHOLD and has_sparse():
+            return "sparse"
+        return "dense"
+    return backend
+
+
+def to_dense(rows, cols, vals, size):
+    """Builds a dense matrix out of COO triplets. Duplicate entries are
+    summed, like scipy does"""
+    A = np.zeros((size, size))
+    np.add.at(A, (rows, cols), vals)
+    return A
+
+
+def to_sparse(rows, cols, vals, size):
+    """Builds a CSC matrix out of COO triplets"""
+    coo = load_scipy().sparse.coo_matrix((vals, (rows, cols)), shape=(size, size))
+    return coo.tocsc()
+
+
+class Factorization:
+    """
+    LU factorization of a system matrix. The matrix is factored once when the
+    object is created and can then be reused for any number of right-hand sides
+    """
+    def __init__(self, rows, cols, vals, size, backend="auto"):
+        """
+        params:
+            rows, cols, vals: array-like. the nonzero entries of A
+            size: int. number of unknowns
+            backend: str. one of BACKENDS
+        """
+        self.size = size
+        self.backend = pick_backend(backend, size)
+        self.scipy = load_scipy()
+        # kept for the low-rank updates of later matrices
+        self.triplets = (np.asarray(rows), np.asarray(cols), np.asarray(vals))
+        self.nnz = len(self.triplets[2])
+
+        if self.backend == "sparse":
+            try:
+                self.lu = self.scipy.sparse.linalg.splu(to_sparse(rows, cols, \
+                                                                  vals, size))
+            except RuntimeError: # splu complains about singular matrices
+                raise LinAlgError("Singular matrix")
+        elif self.scipy is not None:
+            A = to_dense(rows, cols, vals, size)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.lu = self.scipy.linalg.lu_factor(A, check_finite=False)
+            if np.any(np.diag(self.lu[0]) == 0):
+                # lu_factor only warns about singular matrices
+                raise LinAlgError("Singular matrix")
+        else:
+            # no scipy: fall back to the inverse, which is fine for the small
+            # systems the dense backend is meant for
+            self.lu = inv(to_dense(rows, cols, vals, size))
+
+    def solve(self, b):
+        """
+        Solves Ax = b with the stored factorization
+        params:
+            b: array of shape (size,) or (size, k)
+        return:
+            array with the same shape as b
+        """
+        if self.backend == "sparse":
+            return self.lu.solve(b)
+        elif self.scipy is not None:
+            return self.scipy.linalg.lu_solve(self.lu, b, check_finite=False)
+        return self.lu @ b
+
+
+class LowRankUpdate:
+    """
+    Solves with a matrix A that differs from an already factored matrix A0 in a
+    few rows, e.g. after a switch was flipped or a resistance changed. With E
+    picking the k changed rows and D holding their change (A = A0 + E D), the
+    Woodbury identity gives
+        x = y - Z (I + D Z)^-1 D y, where y = A0^-1 b and Z = A0^-1 E
+    Setting up takes k solves with A0 instead of a new factorization and every
+    solve costs one solve with A0 plus O(k * size)
+    """
+    def __init__(self, base, rows, cols, vals, changed):
+        """
+        params:
+            base: class Factorization object of A0
+            rows, cols, vals: array-like. the nonzero entries of A
+            changed: array of the rows of A that differ from A0
+        """
+        self.base = base
+        self.size = base.size
+        self.backend = base.backend
+        k = len(changed)
+
+        # the changed rows of A minus those of A0
+        pos = np.full(self.size, -1)
+        pos[changed] = np.arange(k)
+        self.delta = np.zeros((k, self.size))
+        for (r, c, v), sign in [((rows, cols, vals), 1.), (base.triplets, -1.)]:
+            r, c, v = np.asarray(r), np.asarray(c), np.asarray(v)
+            keep = pos[r] >= 0
+            np.add.at(self.delta, (pos[r[keep]], c[keep]), sign * v[keep])
+
+        E = np.zeros((self.size, k))
+        E[changed, np.arange(k)] = 1.
+        self.Z = base.solve(E)
+        cap = np.eye(k) + self.delta @ self.Z
+        if np.linalg.cond(cap) > 1e+12:
+            # A is singular or too close to it for the update to be accurate
+            raise LinAlgError("Singular matrix")
+        self.cap_inv = inv(cap)
+        self.nnz = base.nnz + np.count_nonzero(self.delta)
+
+    def solve(self, b):
+        """
+        Solves Ax = b
+        params:
+            b: array of shape (size,) or (size, k)
+        return:
+            array with the same shape as b
+        """
+        y = self.base.solve(b)
+        return y - self.Z @ (self.cap_inv @ (self.delta @ y))
+
+
+def refactor(base, rows, cols, vals, changed, size, backend="auto"):
+    """
+    Prepares a matrix A for solving. If A only differs from the matrix of base
+    in a few rows, base is reused with a LowRankUpdate; otherwise A is factored
+    params:
+        base: class Factorization object of an earlier matrix, or None
+        rows, cols, vals: array-like. the nonzero entries of A
+        changed: array of the rows of A that differ from the matrix of base
+        size: int. number of unknowns
+        backend: str. one of BACKENDS
+    return:
+        class Factorization or LowRankUpdate object
+    """
+    if base is not None and len(changed) <= MAX_UPDATE_RANK:
+        if len(changed) == 0:
+            return base
+        try:
+            return LowRankUpdate(base, rows, cols, vals, changed)
+        except LinAlgError:
+            pass # let the full factorization decide if A is singular
+    return Factorization(rows, cols, vals, size, backend)
@@ -0,0 +1,67 @@
+"""
+Checks the import time of the simulation modules against a startup budget
+using python -X importtime. Short simulations are launched in large numbers,
+so the modules must not pull in anything heavy (matplotlib, scipy) before any
+math happens.
+
+Usage: python startup_check.py [budget in ms] [module ...]
+"""
+import subprocess
+import sys
+
+# milliseconds. numpy alone takes roughly 100 ms
+DEFAULT_BUDGET = 250.
+DEFAULT_MODULES = ["circuit", "sweep"]
+# modules that may only be imported once they are actually used
+LAZY = ["matplotlib", "scipy", "report", "sample_circuits"]
+
+
+def import_times(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime
+    params:
+        module: str. name of the module
+    return:
+        total: float. cumulative import time of the module in ms
+        imported: list of the names of all the modules that were imported
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", \
+                           "import " + module], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise ImportError(proc.stderr)
+
+    total = 0.
+    imported = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported.append(name.strip())
+        if name.strip() == module:
+            total = int(cumulative) / 1000.
+    return total, imported
+
+
+def check(budget=DEFAULT_BUDGET, modules=DEFAULT_MODULES):
+    """
+    return:
+        bool. whether every module was imported within budget without loading
+            any of the LAZY modules
+    """
+    ok = True
+    for module in modules:
+        total, imported = import_times(module)
+        eager = [m for m in imported if m.split(".")[0] in LAZY]
+        within = total <= budget and len(eager) == 0
+        ok = ok and within
+        print("{0}: {1:0.1f} ms (budget {2:0.1f} ms) {3}".format(module, total, \
+              budget, "OK" if within else "OVER"))
+        if eager:
+            print("    imported eagerly:", ", ".join(sorted(set(eager))))
+    return ok
+
+
+if __name__ == "__main__":
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET
+    modules = sys.argv[2:] if len(sys.argv) > 2 else DEFAULT_MODULES
+    sys.exit(0 if check(budget, modules) else 1)
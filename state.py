@@ -0,0 +1,308 @@
+import numpy as np
+from components import *
+
+# The type codes of the components. A component's code is its type's index
+KINDS = [Junction, Null_Component, Switch, Multimeter, DC_Battery, Resistor, \
+         Light_Bulb, Capacitor, Inductor]
+JUNCTION, NULL, SWITCH, METER, BATTERY, RESISTOR, BULB, CAPACITOR, INDUCTOR = \
+    range(len(KINDS))
+
+# components that are emf sources in the nodal analysis
+SOURCES = [BATTERY, CAPACITOR]
+# components whose voltage drop is IR
+RESISTIVE = [RESISTOR, BULB, METER]
+
+
+def kind_of(comp):
+    """Returns the type code of a component"""
+    return KINDS.index(type(comp))
+
+
+class CircuitState:
+    """
+    Struct-of-arrays representation of the components of a Circuit. All the
+    per-step calculations are done on these arrays; the Component objects are
+    bound to them and only act as views for the user.
+
+    The Circuit must already have its Junctions and Null_Components added:
+    every two-terminal component connects two Junctions and one Junction is the
+    ground node.
+    """
+    def __init__(self, comps):
+        """
+        params:
+            comps: list or array of Components. the vertices of the Circuit
+        """
+        n = len(comps)
+        self.size = n
+        # bumped whenever something the matrix depends on changes. see touch
+        self.version = 0
+        # the version at which the row of every component last changed (0:
+        # never), so memory doesn't grow with the number of changes
+        self.touched = np.zeros(n, dtype=int)
+
+        self.kind = np.array([kind_of(c) for c in comps], dtype=np.int8)
+        self.emf = np.array([c.emf for c in comps], dtype=float)
+        self.curr = np.array([c.curr for c in comps], dtype=float)
+        self.res = np.array([c.res for c in comps], dtype=float)
+        self.cpty = np.array([c.cpty if isinstance(c, Capacitor) else 0. \
+                              for c in comps])
+        self.L = np.array([c.L if isinstance(c, Inductor) else 0. \
+                           for c in comps])
+        # False only for switches that are OFF
+        self.closed = np.array([c.state == State.ON if isinstance(c, Switch) \
+                                else True for c in comps])
+
+        # the ground Junction. see Circuit.add_junctions. it is the last
+        # component unless components were added or removed after building
+        grounds = [i for i in np.flatnonzero(self.kind == JUNCTION) \
+                   if comps[i].is_ground]
+        self.ground = grounds[-1] if grounds else n - 1
+        # position of every component's unknown in the nodal analysis. the
+        # ground node has none, so it swaps places with the last component
+        self.unknown = np.arange(n)
+        self.unknown[[self.ground, n - 1]] = [n - 1, self.ground]
+
+        # the index sets used every step
+        is_junction = self.kind == JUNCTION
+        self.junctions = np.flatnonzero(is_junction)
+        self.branches = np.flatnonzero(~is_junction)
+        self.sources = np.flatnonzero(np.isin(self.kind, SOURCES))
+        self.batteries = np.flatnonzero(self.kind == BATTERY)
+        self.resistive = np.flatnonzero(np.isin(self.kind, RESISTIVE))
+        self.capacitors = np.flatnonzero(self.kind == CAPACITOR)
+        self.inductors = np.flatnonzero(self.kind == INDUCTOR)
+        self.meters = np.flatnonzero(self.kind == METER)
+        self.bulbs = np.flatnonzero(self.kind == BULB)
+
+        # the terminals of the two-terminal components (-1 for Junctions)
+        self.cxn = np.full((n, 2), -1)
+        for i in self.branches:
+            self.cxn[i] = comps[i].cxns[:2]
+
+        # signed incidence between Junctions (rows) and components (cols) as
+        # COO triplets. +1 when the component's first terminal is the Junction
+        # and -1 when it is the second. see Circuit.get_curr_dir
+        rows, cols, vals = [], [], []
+        for t, sign in [(0, 1.), (1, -1.)]:
+            ends = self.cxn[self.branches, t]
+            at_junction = is_junction[ends]
+            rows.append(ends[at_junction])
+            cols.append(self.branches[at_junction])
+            vals.append(np.full(np.count_nonzero(at_junction), sign))
+        self.inc_rows = np.concatenate(rows)
+        self.inc_cols = np.concatenate(cols)
+        self.inc_vals = np.concatenate(vals)
+
+        self.bind(comps)
+
+    def bind(self, comps):
+        """Turns the Components into views of this CircuitState"""
+        for i in range(len(comps)):
+            comps[i].circuit_state = self
+            comps[i].index = i
+
+    def touch(self, i):
+        """Records that the row of component i in the matrix has changed"""
+        self.version += 1
+        self.touched[i] = self.version
+
+    def changed_rows(self, version):
+        """
+        The rows of the matrix that have changed since the given version
+        return:
+            array of row indices, i.e. positions in self.unknown
+        """
+        comps = np.flatnonzero(self.touched > version)
+        return self.unknown[comps[comps != self.ground]]
+
+    def variables(self):
+        """The state variables: capacitor voltages, then inductor currents"""
+        return np.concatenate([self.emf[self.capacitors], \
+                               self.curr[self.inductors]])
+
+    def matrix(self, res=None, companion=None, closed=None):
+        """
+        Builds the matrix of the nodal analysis. Every component except for the
+        ground node gets a row:
+        * Junctions: Kirchhoff's current law
+        * inductors, without a companion: their current, which forward Euler
+          already knows
+        * other components: the voltage drop across them
+        params:
+            res: optional. array of shape (..., size). resistances to use
+                instead of self.res, e.g. one row per variant of a batch
+            companion: optional. array of shape (size,). added to the diagonal
+                of the capacitor and inductor rows. this is how the implicit
+                integrators turn them into companion models. see
+                integrators.py. zeros make the inductors shorts
+            closed: optional. bool array of shape (size,) to use instead of
+                self.closed. components that are not closed carry no current
+        return:
+            rows, cols: arrays. the positions of the entries
+            vals: array of shape (..., nnz). the matrix as COO triplets
+        """
+        if res is None:
+            res = self.res
+        if closed is None:
+            closed = self.closed
+        batch = res.shape[:-1]
+        g = self.ground
+        rows, cols, vals = [], [], []
+
+        def add(r, c, v):
+            rows.append(r)
+            cols.append(c)
+            vals.append(np.broadcast_to(v, batch + (len(r),)))
+
+        # currents into (-1) and out of (1) the Junctions
+        keep = self.inc_rows != g
+        add(self.inc_rows[keep], self.inc_cols[keep], self.inc_vals[keep])
+
+        comps = self.branches[self.branches != g]
+
+        # no current flows through an open switch
+        opened = comps[~closed[comps]]
+        add(opened, opened, 1.)
+        if companion is None:
+            # the current of an inductor only changes between steps
+            inds = comps[self.kind[comps] == INDUCTOR]
+            add(inds, inds, 1.)
+            comps = comps[self.kind[comps] != INDUCTOR]
+
+        # voltages
+        comps = comps[closed[comps]]
+        v_drop = np.where(np.isin(self.kind[comps], SOURCES), 1., -1.)
+        resistive = comps[np.isin(self.kind[comps], RESISTIVE)]
+        add(resistive, resistive, res[..., resistive])
+
+        if companion is not None:
+            react = np.concatenate([self.capacitors, self.inductors])
+            add(react, react, companion[react])
+
+        for t, sign in [(0, -1.), (1, 1.)]:
+            ends = self.cxn[comps, t]
+            keep = ends != g
+            add(comps[keep], ends[keep], sign * v_drop[keep])
+
+        u = self.unknown
+        return u[np.concatenate(rows)], u[np.concatenate(cols)], \
+               np.concatenate(vals, axis=-1)
+
+    def rhs(self, emf=None, curr=None):
+        """
+        Builds the right-hand side of the nodal analysis: the emf sources and
+        the currents of the inductors. see matrix()
+        params:
+            emf, curr: optional. arrays of shape (..., size) to use instead of
+                self.emf and self.curr
+        return:
+            array of shape (..., size-1, 1)
+        """
+        if emf is None:
+            emf = self.emf
+        if curr is None:
+            curr = self.curr
+        b = np.zeros(emf.shape[:-1] + (self.size - 1, 1))
+        src = self.sources[self.sources != self.ground]
+        b[..., self.unknown[src], 0] = emf[..., src]
+        ind = self.inductors
+        b[..., self.unknown[ind], 0] = curr[..., ind]
+        return b
+
+    def scatter(self, x, emf=None, curr=None):
+        """
+        Equates the solution of the nodal analysis with the components
+        params:
+            x: array of shape (..., size-1, 1). node voltages for the Junctions
+                and currents for the other components, in the order of
+                self.unknown
+            emf, curr: optional. arrays of shape (..., size) to write to instead
+                of self.emf and self.curr
+        """
+        if emf is None:
+            emf, curr = self.emf, self.curr
+        x = x[..., 0]
+        j = self.junctions[self.junctions != self.ground]
+        emf[..., j] = x[..., self.unknown[j]]
+        c = self.branches[self.branches != self.ground]
+        curr[..., c] = x[..., self.unknown[c]]
+
+    def direction(self, node, comp):
+        """
+        Direction of the current of components at their terminals, from the
+        incidence table. see Circuit.get_curr_dir
+        params:
+            node, comp: ints or arrays of component indices
+        return:
+            int array. 1 where node is comp's first terminal, -1 where it is the
+            second and 0 where they are not connected
+        """
+        ends = self.cxn[comp]
+        return np.where(ends[..., 0] == node, 1, np.where(ends[..., 1] == node, -1, 0))
+
+    def inflow(self, curr=None):
+        """
+        Net current into every component from the components connected to it,
+        i.e. the product of the incidence matrix and the currents. Nonzero only
+        for the Junctions
+        params:
+            curr: optional. array of shape (..., size) to use instead of
+                self.curr
+        return:
+            array of shape (..., size)
+        """
+        if curr is None:
+            curr = self.curr
+        flow = self.inc_vals * curr[..., self.inc_cols]
+        if flow.ndim == 1:
+            return np.bincount(self.inc_rows, flow, minlength=self.size)
+        # one bincount for the whole batch: every variant gets its own range
+        # of bins
+        batch = flow.shape[:-1]
+        flow = flow.reshape(-1, flow.shape[-1])
+        bins = self.inc_rows + self.size * np.arange(len(flow))[:, None]
+        net = np.bincount(bins.ravel(), flow.ravel(), \
+                          minlength=self.size * len(flow))
+        return net.reshape(batch + (self.size,))
+
+    def junction_currents(self, curr=None):
+        """Net current into every Junction (Kirchhoff's current law)"""
+        return self.inflow(curr)[..., self.junctions]
+
+    def advance(self, dt, emf=None, curr=None, res=None, cpty=None, L=None):
+        """
+        Completes the calculations of a step once the currents are known
+        params:
+            dt: time step
+            emf, curr, res, cpty, L: optional. arrays of shape (..., size) to
+                use instead of the ones of the CircuitState
+        """
+        if emf is None:
+            emf, curr, res, cpty = self.emf, self.curr, self.res, self.cpty
+        if L is None:
+            L = self.L
+        self.settle(emf, curr, res)
+
+        # forward Euler
+        c = self.capacitors
+        emf[..., c] += curr[..., c] * dt / cpty[..., c]
+        ind = self.inductors
+        curr[..., ind] += emf[..., ind] * dt / L[..., ind]
+
+    def settle(self, emf=None, curr=None, res=None):
+        """
+        Fills in the values that follow directly from the solution of the
+        nodal analysis: Junction currents and the voltage drops of the
+        resistive components and the inductors
+        params: see advance()
+        """
+        if emf is None:
+            emf, curr, res = self.emf, self.curr, self.res
+        curr[..., self.junctions] = self.junction_currents(curr)
+
+        r = self.resistive
+        emf[..., r] = curr[..., r] * res[..., r]
+        # like the resistive components, the difference of the terminals
+        ind = self.inductors
+        emf[..., ind] = emf[..., self.cxn[ind, 1]] - emf[..., self.cxn[ind, 0]]
@@ -0,0 +1,98 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from numpy.lib.format import open_memmap
+from circuit import Circuit
+from circuit_file import load_circuit
+
+
+def grid_variants(grid):
+    """
+    Expands a parameter grid into all of its combinations
+    params:
+        grid: dict. {component index: {attribute: list of values}}
+    return:
+        keys: list of (component index, attribute)
+        values: array of shape (K, len(keys)). one row per combination
+    """
+    keys = [(idx, attr) for idx in grid for attr in grid[idx]]
+    axes = [grid[idx][attr] for idx, attr in keys]
+    values = np.array(list(itertools.product(*axes)), dtype=float)
+    return keys, values.reshape(-1, len(keys))
+
+
+def build_circuit(path, dt, n, solver):
+    """Loads and builds a circuit without simulating it"""
+    V, E, file_dt, file_n = load_circuit(path)
+    dt = dt if dt is not None else (file_dt if file_dt is not None else 0.01)
+    n = n if n is not None else (file_n if file_n is not None else 100)
+    circ = Circuit(V, E, dt, n, solver, simulate=False, log=None, plot=False)
+    if not circ.build():
+        raise ValueError("Circuit is not valid", path)
+    return circ
+
+
+def run_chunk(args):
+    """
+    Worker of run_sweep: simulates one chunk of the variants and writes the
+    results straight into the shared output file
+    """
+    path, dt, n, solver, keys, values, start, out_path = args
+    circ = build_circuit(path, dt, n, solver)
+
+    params = {}
+    for col in range(len(keys)):
+        idx, attr = keys[col]
+        params.setdefault(idx, {})[attr] = values[:, col]
+    v, i = circ.simulate_batch(params)
+
+    out = open_memmap(out_path, mode="r+")
+    out[start:start+len(values), 0] = v
+    out[start:start+len(values), 1] = i
+    out.flush()
+    return len(values)
+
+
+def run_sweep(path, grid, out_path, dt=None, n=None, solver="auto", \
+              workers=None, chunks_per_worker=4):
+    """
+    Simulates every combination of a parameter grid of a saved circuit over a
+    pool of processes. Each worker loads the circuit itself and simulates its
+    chunk of the grid as a batch (see Circuit.simulate_batch), so only file
+    names and parameter values are sent to the workers and nothing but a count
+    comes back.
+    params:
+        path: str. circuit file, see circuit_file.load_circuit
+        grid: dict. {component index: {attribute: list of values}}. see
+            Circuit.simulate_batch for the attributes
+        out_path: str. .npy file the results are written to
+        dt, n: optional. override the time step and number of steps
+        solver: optional. see Circuit
+        workers: optional. number of processes. defaults to the CPU count
+        chunks_per_worker: optional. how finely the grid is split up
+    return:
+        keys: list of (component index, attribute). the columns of values
+        values: array of shape (K, len(keys)). the parameters of each variant
+        results: memory-mapped array of shape (K, 2, num_steps, lenv). the
+            voltages ([:, 0]) and currents ([:, 1]) of every variant
+    """
+    keys, values = grid_variants(grid)
+    workers = workers or os.cpu_count() or 1
+
+    # build once to find out the size of the results
+    circ = build_circuit(path, dt, n, solver)
+    shape = (len(values), 2, circ.num_steps, circ.lenv)
+    open_memmap(out_path, mode="w+", dtype=float, shape=shape).flush()
+
+    num_chunks = min(len(values), workers * chunks_per_worker)
+    jobs = []
+    start = 0
+    for chunk in np.array_split(values, num_chunks):
+        jobs.append((path, dt, n, solver, keys, chunk, start, out_path))
+        start += len(chunk)
+
+    with ProcessPoolExecutor(workers) as ex:
+        list(ex.map(run_chunk, jobs))
+
+    return keys, values, np.load(out_path, mmap_mode="r")
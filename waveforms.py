@@ -0,0 +1,185 @@
+import numpy as np
+
+
+class Waveforms:
+    """
+    Preallocated storage for the histories of all the components of a Circuit.
+    Every quantity gets one (num_steps, num_comps) array: row k holds step k and
+    column i holds component i. Components expose their histories as views into
+    these arrays, so nothing is copied while simulating.
+    """
+    def __init__(self, num_steps, num_comps):
+        """
+        params:
+            num_steps: int. number of steps to allocate for. usually len(t_hist)
+            num_comps: int. number of components in the Circuit
+        """
+        self.v = np.zeros((num_steps, num_comps))
+        self.i = np.zeros((num_steps, num_comps))
+        self.reading = np.zeros((num_steps, num_comps))
+        # number of steps that have been recorded so far
+        self.n = 0
+
+    @property
+    def capacity(self):
+        return self.v.shape[0]
+
+    def grow(self):
+        """Doubles the capacity. Only happens if more steps are recorded than
+        were allocated for"""
+        for q in ["v", "i", "reading"]:
+            old = getattr(self, q)
+            new = np.zeros((max(2 * old.shape[0], 1), old.shape[1]))
+            new[:old.shape[0]] = old
+            setattr(self, q, new)
+
+    def record(self, v, i, reading=None):
+        """
+        Stores the values of one step
+        params:
+            v: array-like. voltage of every component
+            i: array-like. current of every component
+            reading: optional. array-like. multimeter readings
+        """
+        if self.n == self.capacity:
+            self.grow()
+        self.v[self.n] = v
+        self.i[self.n] = i
+        if reading is not None:
+            self.reading[self.n] = reading
+        self.n += 1
+
+    def attach(self, comps):
+        """Points the histories of comps (in order) to this storage"""
+        for idx in range(len(comps)):
+            comps[idx].waveforms = self
+            comps[idx].index = idx
+
+    def add_comps(self, k=1):
+        """Adds k components at the end. Their histories are 0 up to now"""
+        for q in ["v", "i", "reading"]:
+            old = getattr(self, q)
+            new = np.zeros((old.shape[0], old.shape[1] + k))
+            new[:, :old.shape[1]] = old
+            setattr(self, q, new)
+
+    def remove_comp(self, idx):
+        """Drops the history of component idx. Like Circuit.remove_vertex, the
+        last component takes its place"""
+        for q in ["v", "i", "reading"]:
+            old = getattr(self, q)
+            old[:, idx] = old[:, -1]
+            setattr(self, q, old[:, :-1])
+
+
+class WaveformSink:
+    """
+    Streams the histories of a Circuit to a .npy file in chunks instead of
+    keeping them in memory, so long runs use the same amount of memory no
+    matter how many steps they have. Only every k-th step of a selection of
+    components (the probes) is kept, and the last step, so that the file
+    always ends with the final state.
+
+    The file holds a float64 array of shape (rows, 1 + 2P) for P probes: the
+    time, the voltages of the probes and then their currents. see read_stream
+    """
+    # fixed size of the .npy header so that it can be rewritten in place
+    HEADER_LEN = 128
+
+    def __init__(self, path, num_steps, probes, every=1, chunk=4096, \
+                 times=None):
+        """
+        params:
+            path: str. the .npy file to write
+            num_steps: int. number of steps that will be recorded
+            probes: list of the indices of the components to keep
+            every: optional. keep every k-th step
+            chunk: optional. number of rows kept in memory before writing
+            times: optional. callable giving the time of a step. defaults to
+                the step number
+        """
+        self.path = path
+        self.probes = np.asarray(probes, dtype=int)
+        self.every = max(int(every), 1)
+        self.times = times if times is not None else float
+        self.rows = 0 # rows written to the file
+        self.n = 0 # steps recorded, kept or not
+
+        self.buffer = np.zeros((max(int(chunk), 1), 1 + 2 * len(self.probes)), \
+                               dtype="<f8")
+        self.filled = 0
+        # the last step, if it wasn't kept. see close
+        self.last = np.zeros(self.buffer.shape[1], dtype="<f8")
+        self.skipped = False
+        self.file = open(path, "wb")
+        self.write_header(-(-num_steps // self.every))
+
+    def write_header(self, rows):
+        """Writes a version 1.0 .npy header for the given number of rows"""
+        header = repr({"descr": "<f8", "fortran_order": False, \
+                       "shape": (rows, self.buffer.shape[1])})
+        length = self.HEADER_LEN - 10 # magic string, version and length
+        header = header.ljust(length - 1) + "\n"
+        self.file.seek(0)
+        self.file.write(b"\x93NUMPY\x01\x00")
+        self.file.write(np.uint16(length).tobytes())
+        self.file.write(header.encode("latin1"))
+
+    def record(self, v, i, reading=None):
+        """
+        Stores the values of one step if it is one of the kept ones
+        params:
+            v: array-like. voltage of every component
+            i: array-like. current of every component
+            reading: ignored. multimeter readings equal their voltage/current
+        """
+        kept = self.n % self.every == 0
+        row = self.buffer[self.filled] if kept else self.last
+        p = len(self.probes)
+        row[0] = self.times(self.n)
+        row[1:1+p] = np.asarray(v)[self.probes]
+        row[1+p:] = np.asarray(i)[self.probes]
+        self.skipped = not kept
+        if kept:
+            self.filled += 1
+            if self.filled == len(self.buffer):
+                self.flush()
+        self.n += 1
+
+    def flush(self):
+        """Writes the buffered rows to the file"""
+        self.file.seek(self.HEADER_LEN + self.rows * self.buffer[0].nbytes)
+        self.file.write(self.buffer[:self.filled].tobytes())
+        self.rows += self.filled
+        self.filled = 0
+
+    def close(self):
+        """Writes whatever is left, including the last step if it wasn't kept,
+        and fixes the header to the number of rows written"""
+        if self.file.closed:
+            return
+        if self.skipped:
+            if self.filled == len(self.buffer):
+                self.flush()
+            self.buffer[self.filled] = self.last
+            self.filled += 1
+            self.skipped = False
+        self.flush()
+        self.write_header(self.rows)
+        self.file.truncate(self.HEADER_LEN + self.rows * self.buffer[0].nbytes)
+        self.file.close()
+
+
+def read_stream(path, mmap_mode="r"):
+    """
+    Reads a file written by WaveformSink
+    params:
+        path: str. the .npy file
+        mmap_mode: optional. passed to np.load
+    return:
+        t: array of shape (rows,). time of every kept step
+        v, i: arrays of shape (rows, P). voltages and currents of the probes
+    """
+    data = np.load(path, mmap_mode=mmap_mode)
+    p = (data.shape[1] - 1) // 2
+    return data[:, 0], data[:, 1:1+p], data[:, 1+p:]